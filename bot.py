@@ -1,57 +1,671 @@
+import time
+PROCESS_STARTED = time.perf_counter()  # Taken before any heavy import for the startup report
+
 import discord
+from discord import app_commands
 from discord.ext import commands
-import yt_dlp
 import os
 import asyncio
 import logging
 from datetime import datetime
 import tempfile
-import aiohttp
 import json
 from dotenv import load_dotenv
-import gtts
-from io import BytesIO
 import signal
 import sys
+import shutil
+import contextlib
+import contextvars
+import threading
+import queue
+import atexit
+import uuid
+import importlib
+import types
+import copy
+import sqlite3
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from collections import OrderedDict, deque
+
+import media_worker
+
+# yt_dlp and gtts are heavy (yt-dlp's extractor registry alone takes seconds), so they
+# are imported lazily through lazy_import() and warmed in the background after on_ready
 
 # Load environment variables
 load_dotenv()
 
 # Bot configuration
-UPDATE_CHANNEL_ID = os.getenv('UPDATE_CHANNEL_ID')  # Channel ID for updates
+UPDATE_CHANNEL_ID = os.getenv('UPDATE_CHANNEL_ID', '')  # Global channel ID for updates
+UPDATE_CHANNEL_ID = int(UPDATE_CHANNEL_ID) if UPDATE_CHANNEL_ID.isdigit() else None
+SETTINGS_DB = os.getenv('SETTINGS_DB', 'bot_settings.db')  # Per-guild settings (SQLite)
+BROADCAST_BATCH_SIZE = 10  # Channels messaged concurrently per broadcast batch
+ENABLE_PREFIX_COMMANDS = os.getenv('ENABLE_PREFIX_COMMANDS', 'true').lower() in ('1', 'true', 'yes')
+SYNC_COMMANDS_ON_STARTUP = os.getenv('SYNC_COMMANDS_ON_STARTUP', 'false').lower() in ('1', 'true', 'yes')
+BROADCAST_BATCH_DELAY = 1.0  # Seconds between batches, keeps us well under the global rate limit
+DRAIN_TIMEOUT = int(os.getenv('DRAIN_TIMEOUT_SECONDS', '25'))  # Keep below the platform's SIGTERM grace period
 BOT_VERSION = "2.1.3"  # Current bot version
 LAST_UPDATE = "2025-10-21"  # Last update date
+BOT_STATE_FILE = os.getenv('BOT_STATE_FILE', 'bot_state.json')  # Survives restarts (e.g. announced version)
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('bot.log'),
-        logging.StreamHandler()
-    ]
+# Media limits
+MAX_FILE_SIZE_BYTES = int(os.getenv('MAX_FILE_SIZE_MB', '8')) * 1024 * 1024
+MAX_MEDIA_DURATION = int(os.getenv('MAX_VIDEO_DURATION_SECONDS', '600'))  # For clips only the section counts
+
+# Batch download configuration
+MAX_CONCURRENT_DOWNLOADS = int(os.getenv('MAX_CONCURRENT_DOWNLOADS', '3'))
+MAX_BATCH_ITEMS = int(os.getenv('MAX_BATCH_ITEMS', '10'))
+MAX_ATTACHMENTS_PER_MESSAGE = 10  # Discord hard limit
+
+# Download engine tuning
+FRAGMENT_CONCURRENCY = int(os.getenv('FRAGMENT_CONCURRENCY', '4'))  # Per-job HLS/DASH fragments in flight
+MAX_FRAGMENT_CONNECTIONS = int(os.getenv('MAX_FRAGMENT_CONNECTIONS', '12'))  # Across all jobs
+HTTP_CHUNK_SIZE = int(os.getenv('HTTP_CHUNK_SIZE_MB', '10')) * 1024 * 1024
+EXTERNAL_DOWNLOADER = os.getenv('EXTERNAL_DOWNLOADER', '')  # e.g. aria2c
+PLAYLIST_FLAGS = ('playlist', '--playlist', 'قائمة')
+
+# Media worker sandbox (yt-dlp and the ffmpeg it spawns run in resource-limited subprocesses)
+WORKER_SANDBOX = os.getenv('WORKER_SANDBOX', 'true' if os.name == 'posix' else 'false').lower() in ('1', 'true', 'yes')
+WORKER_MAX_RSS_BYTES = int(os.getenv('WORKER_MAX_RSS_MB', '768')) * 1024 * 1024  # Whole worker process tree
+WORKER_MAX_MEMORY_BYTES = int(os.getenv('WORKER_MAX_MEMORY_MB', '2048')) * 1024 * 1024  # Address space per process
+WORKER_MAX_CPU_SECONDS = int(os.getenv('WORKER_MAX_CPU_SECONDS', '300'))
+WORKER_TIMEOUT = int(os.getenv('WORKER_TIMEOUT_SECONDS', '600'))  # Wall clock per job
+WORKER_POOL_SIZE = int(os.getenv('WORKER_POOL_SIZE', str(MAX_CONCURRENT_DOWNLOADS + 1)))
+WORKER_MAX_JOBS = int(os.getenv('WORKER_MAX_JOBS', '50'))  # Jobs before a worker is replaced
+MEDIA_WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'media_worker.py')
+
+# Voice streaming configuration
+STREAM_CACHE_TTL = int(os.getenv('STREAM_CACHE_TTL_SECONDS', '1800'))  # Signed media URLs expire
+MAX_QUEUE_SIZE = int(os.getenv('MAX_QUEUE_SIZE', '25'))
+VOICE_IDLE_TIMEOUT = int(os.getenv('VOICE_IDLE_TIMEOUT_SECONDS', '300'))
+FFMPEG_STREAM_BEFORE_OPTIONS = '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5 -nostdin'
+FFMPEG_STREAM_OPTIONS = '-vn'
+
+# Temp storage configuration (point MEDIA_TEMP_DIR at a tmpfs for small clips)
+# The bot only ever works in its own subdirectory, since the janitor deletes what it finds there
+MEDIA_TEMP_DIR = os.path.join(os.getenv('MEDIA_TEMP_DIR') or tempfile.gettempdir(), 'discord-video-bot')
+MEDIA_TEMP_QUOTA_BYTES = int(os.getenv('MEDIA_TEMP_QUOTA_MB', '512')) * 1024 * 1024
+MEDIA_MIN_FREE_BYTES = int(os.getenv('MEDIA_MIN_FREE_MB', '256')) * 1024 * 1024
+MEDIA_ORPHAN_MAX_AGE = int(os.getenv('MEDIA_ORPHAN_MAX_AGE_SECONDS', '1800'))
+MEDIA_JANITOR_INTERVAL = int(os.getenv('MEDIA_JANITOR_INTERVAL_SECONDS', '300'))
+
+# Logging configuration
+LOG_FILE = os.getenv('LOG_FILE', 'bot.log')
+LOG_MAX_BYTES = int(os.getenv('LOG_MAX_MB', '10')) * 1024 * 1024
+LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', '5'))
+LOG_SAMPLE_BURST = int(os.getenv('LOG_SAMPLE_BURST', '5'))  # Identical warnings allowed per window
+LOG_SAMPLE_WINDOW = int(os.getenv('LOG_SAMPLE_WINDOW_SECONDS', '60'))
+LOG_CONTEXT_FIELDS = (
+    'guild', 'command', 'job_id', 'url', 'duration_ms', 'size_bytes', 'suppressed', 'peak_rss_kb', 'cpu_seconds'
 )
+
+# Structured context (guild, command, job id) for records emitted by the current task
+log_context = contextvars.ContextVar('log_context', default={})
+
+def bind_log_context(**fields):
+    """Add fields to the log context of the current task"""
+    log_context.set({**log_context.get(), **fields})
+
+class ContextFilter(logging.Filter):
+    """Copy the current task's log context onto each record"""
+
+    def filter(self, record):
+        for key, value in log_context.get().items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        return True
+
+class SamplingFilter(logging.Filter):
+    """Pass the first `burst` warnings of a message template per window and drop the rest"""
+
+    def __init__(self, burst, window, level=logging.WARNING):
+        super().__init__()
+        self.burst = burst
+        self.window = window
+        self.level = level
+        self._counters = {}  # (logger, level, template) -> [window_start, seen]
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        # Only the noisy warning templates are sampled; INFO and errors always pass, and so do
+        # metrics records (timings, worker usage) since they matter most under load
+        if record.levelno != self.level or hasattr(record, 'duration_ms'):
+            return True
+        
+        key = (record.name, record.levelno, str(record.msg))
+        now = time.monotonic()
+        with self._lock:
+            counter = self._counters.get(key)
+            if counter is None or now - counter[0] >= self.window:
+                if counter and counter[1] > self.burst:
+                    record.suppressed = counter[1] - self.burst
+                if len(self._counters) > 10000:
+                    self._counters.clear()
+                counter = self._counters[key] = [now, 0]
+            counter[1] += 1
+            return counter[1] <= self.burst
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, including the structured context fields"""
+
+    def format(self, record):
+        payload = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for field in LOG_CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                payload[field] = value
+        if record.exc_text:
+            payload['exc'] = record.exc_text
+        elif record.exc_info:
+            payload['exc'] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+class StructuredQueueHandler(QueueHandler):
+    """QueueHandler that ships the plain message and keeps the traceback in exc_text"""
+
+    def prepare(self, record):
+        # The default prepare() formats the record into msg, which would bake the console
+        # layout into every JSON line and fold tracebacks into the message
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info and not record.exc_text:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+def setup_logging():
+    """Route all records through a queue so the event loop never does log I/O itself"""
+    file_handler = RotatingFileHandler(
+        LOG_FILE, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding='utf-8'
+    )
+    file_handler.setFormatter(JsonFormatter())
+    
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    
+    log_queue = queue.SimpleQueue()
+    queue_handler = StructuredQueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter())
+    queue_handler.addFilter(SamplingFilter(LOG_SAMPLE_BURST, LOG_SAMPLE_WINDOW))
+    
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    root.addHandler(queue_handler)
+    
+    listener = QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+# Configure logging
+log_listener = setup_logging()
 logger = logging.getLogger(__name__)
 
 # Bot setup with voice support
+# Slash commands need no privileged intents. Prefix commands need message_content, which makes
+# the gateway deliver the content of every message in every guild, so they can be switched off.
+# Messages that mention the bot always carry their content, so mention-prefixed commands keep working.
 intents = discord.Intents.default()
-intents.message_content = True
+intents.typing = False  # Never used; typing events are a large share of gateway traffic
 intents.voice_states = True
+if ENABLE_PREFIX_COMMANDS:
+    intents.message_content = True
 bot = commands.Bot(
-    command_prefix='!', 
+    command_prefix=commands.when_mentioned_or('!') if ENABLE_PREFIX_COMMANDS else commands.when_mentioned, 
     intents=intents,
     help_command=None,
-    case_insensitive=True
+    case_insensitive=True,
+    # Sent with every IDENTIFY, so the status survives reconnects without extra calls
+    activity=discord.Activity(
+        type=discord.ActivityType.watching,
+        name="!download للمساعدة"
+    )
+)
+
+class StartupTimer:
+    """Records when each startup phase finished, relative to process start"""
+
+    def __init__(self, started):
+        self.started = started
+        self.marks = []  # (phase, seconds since process start)
+
+    def mark(self, phase):
+        self.marks.append((phase, time.perf_counter() - self.started))
+
+    def report(self):
+        lines = []
+        previous = 0.0
+        for phase, elapsed in sorted(self.marks, key=lambda mark: mark[1]):
+            lines.append(f"{phase}: {elapsed * 1000:.0f} ms (+{(elapsed - previous) * 1000:.0f} ms)")
+            previous = elapsed
+        return "; ".join(lines)
+
+startup_timer = StartupTimer(PROCESS_STARTED)
+startup_timer.mark('imports')
+
+def lazy_import(name):
+    """Import a heavy module on first use, logging how long it took"""
+    module = sys.modules.get(name)
+    if module is None:
+        started = time.perf_counter()
+        module = importlib.import_module(name)
+        logger.info("Loaded %s in %.0f ms", name, (time.perf_counter() - started) * 1000)
+    return module
+
+class StorageFullError(Exception):
+    """Raised when a workspace cannot be reserved without exceeding the quota"""
+
+class StorageManager:
+    """Owns all media scratch space: quota accounting, workspaces and orphan cleanup"""
+
+    def __init__(self, root, quota_bytes, min_free_bytes, orphan_max_age):
+        self.root = root
+        self.quota_bytes = quota_bytes
+        self.min_free_bytes = min_free_bytes
+        self.orphan_max_age = orphan_max_age
+        self.reserved_bytes = 0
+        self._active = {}  # workspace path -> reserved bytes
+        self._janitor_task = None
+        os.makedirs(self.root, exist_ok=True)
+
+    def free_bytes(self):
+        """Free bytes on the filesystem holding the storage root"""
+        try:
+            return shutil.disk_usage(self.root).free
+        except OSError:
+            return 0
+
+    def pressure(self):
+        """Disk pressure between 0.0 (idle) and 1.0 (full), used for backpressure"""
+        quota_pressure = self.reserved_bytes / self.quota_bytes if self.quota_bytes else 0.0
+        free = self.free_bytes()
+        disk_pressure = 1.0 if free <= self.min_free_bytes else self.min_free_bytes / free
+        return min(1.0, max(quota_pressure, disk_pressure))
+
+    def under_pressure(self):
+        """True when new jobs should wait instead of starting"""
+        return self.pressure() >= 0.9
+
+    def can_reserve(self, nbytes):
+        """Check whether nbytes can be reserved right now"""
+        if self.reserved_bytes + nbytes > self.quota_bytes:
+            return False
+        return self.free_bytes() - nbytes >= self.min_free_bytes
+
+    @contextlib.contextmanager
+    def workspace(self, reserve_bytes, prefix='job-'):
+        """Reserve space and yield a private directory that is removed on exit"""
+        if not self.can_reserve(reserve_bytes):
+            raise StorageFullError(
+                f"Cannot reserve {reserve_bytes} bytes "
+                f"(reserved {self.reserved_bytes}/{self.quota_bytes}, free {self.free_bytes()})"
+            )
+
+        os.makedirs(self.root, exist_ok=True)
+        path = tempfile.mkdtemp(prefix=prefix, dir=self.root)
+        self.reserved_bytes += reserve_bytes
+        self._active[path] = reserve_bytes
+        try:
+            yield path
+        finally:
+            self.reserved_bytes -= self._active.pop(path, 0)
+            shutil.rmtree(path, ignore_errors=True)
+
+    def sweep_orphans(self, max_age=None):
+        """Remove entries under the root that no live workspace owns"""
+        max_age = self.orphan_max_age if max_age is None else max_age
+        now = time.time()
+        removed = 0
+
+        try:
+            entries = list(os.scandir(self.root))
+        except FileNotFoundError:
+            return 0
+
+        for entry in entries:
+            if entry.path in self._active:
+                continue
+            try:
+                if now - entry.stat(follow_symlinks=False).st_mtime < max_age:
+                    continue
+                if entry.is_dir(follow_symlinks=False):
+                    shutil.rmtree(entry.path, ignore_errors=True)
+                else:
+                    os.unlink(entry.path)
+                removed += 1
+            except OSError as e:
+                logger.warning("Janitor could not remove %s: %s", entry.path, e)
+
+        return removed
+
+    async def _janitor(self, interval):
+        # The first sweep keeps the age threshold too: during an overlapping restart the
+        # draining instance still has live workspaces under the same root
+        while True:
+            try:
+                removed = await asyncio.to_thread(self.sweep_orphans)
+                if removed:
+                    logger.info(f"Janitor removed {removed} orphaned temp entries from {self.root}")
+            except Exception as e:
+                logger.error(f"Janitor sweep failed: {str(e)}")
+            await asyncio.sleep(interval)
+
+    def start_janitor(self, interval):
+        """Start the background orphan sweeper (idempotent)"""
+        if self._janitor_task is None or self._janitor_task.done():
+            self._janitor_task = asyncio.create_task(self._janitor(interval))
+
+    def stop_janitor(self):
+        """Stop the background orphan sweeper"""
+        if self._janitor_task:
+            self._janitor_task.cancel()
+            self._janitor_task = None
+
+storage = StorageManager(
+    root=MEDIA_TEMP_DIR,
+    quota_bytes=MEDIA_TEMP_QUOTA_BYTES,
+    min_free_bytes=MEDIA_MIN_FREE_BYTES,
+    orphan_max_age=MEDIA_ORPHAN_MAX_AGE
 )
 
+class SettingsStore:
+    """Per-guild settings in SQLite (WAL) behind a write-through in-memory cache"""
+
+    # key -> converter; anything not listed here cannot be stored
+    TYPES = {
+        'update_channel_id': int,
+        'upload_limit_mb': int,
+        'max_concurrent_jobs': int,
+        'tts_language': str,
+        'voice_idle_timeout': int,
+    }
+
+    def __init__(self, path):
+        self.path = path
+        self._cache = {}  # guild id -> {key: value}
+        self._conn = None
+        self._lock = threading.Lock()  # one writer at a time on the shared connection
+
+    def _connect(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS guild_settings ('
+                'guild_id INTEGER NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, '
+                'PRIMARY KEY (guild_id, key))'
+            )
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def _load_sync(self):
+        with self._lock:
+            rows = self._connect().execute('SELECT guild_id, key, value FROM guild_settings').fetchall()
+        cache = {}
+        for guild_id, key, value in rows:
+            if key in self.TYPES:
+                cache.setdefault(guild_id, {})[key] = json.loads(value)
+        return cache
+
+    async def load(self):
+        """Fill the cache from disk; called once at startup"""
+        self._cache = await asyncio.to_thread(self._load_sync)
+        logger.info("Loaded settings for %d guilds from %s", len(self._cache), self.path)
+
+    def _write_sync(self, guild_id, key, value):
+        with self._lock:
+            conn = self._connect()
+            if value is None:
+                conn.execute('DELETE FROM guild_settings WHERE guild_id = ? AND key = ?', (guild_id, key))
+            else:
+                conn.execute(
+                    'INSERT INTO guild_settings (guild_id, key, value) VALUES (?, ?, ?) '
+                    'ON CONFLICT (guild_id, key) DO UPDATE SET value = excluded.value',
+                    (guild_id, key, json.dumps(value))
+                )
+            conn.commit()
+
+    def convert(self, key, raw):
+        """Validate a user-supplied value; raises ValueError when it does not fit the key"""
+        if key not in self.TYPES:
+            raise ValueError(f"Unknown setting: {key}")
+        value = self.TYPES[key](raw)
+        if isinstance(value, int) and value <= 0:
+            raise ValueError(f"{key} must be positive")
+        if isinstance(value, str) and not (0 < len(value) <= 16):
+            raise ValueError(f"{key} has an invalid length")
+        return value
+
+    def get(self, guild_id, key, default=None):
+        """Cached read; never touches disk"""
+        return self._cache.get(guild_id, {}).get(key, default)
+
+    def for_guild(self, guild_id):
+        return dict(self._cache.get(guild_id, {}))
+
+    def values(self, key):
+        """All guilds' values for key, from the cache"""
+        return {guild_id: entries[key] for guild_id, entries in self._cache.items() if key in entries}
+
+    async def set(self, guild_id, key, value):
+        """Persist then cache a value; None removes the override"""
+        if value is not None:
+            value = self.convert(key, value)
+        await asyncio.to_thread(self._write_sync, guild_id, key, value)
+        
+        entries = self._cache.setdefault(guild_id, {})
+        if value is None:
+            entries.pop(key, None)
+        else:
+            entries[key] = value
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+settings = SettingsStore(SETTINGS_DB)
+
+# Reserve room for the raw download plus a merged/remuxed copy
+DOWNLOAD_RESERVE_BYTES = MAX_FILE_SIZE_BYTES * 2
+TTS_RESERVE_BYTES = 2 * 1024 * 1024
+
+class YoutubeDLPool:
+    """Reuses YoutubeDL instances across jobs so their HTTP sessions and extractors stay warm"""
+
+    def __init__(self, max_idle_per_profile=4):
+        self.max_idle_per_profile = max_idle_per_profile
+        self._idle = {}  # profile -> [YoutubeDL]
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def acquire(self, profile, opts, **params):
+        """Check out an instance for one job; params are per-job overrides applied on top"""
+        with self._lock:
+            idle = self._idle.get(profile)
+            ydl = idle.pop() if idle else None
+        
+        if ydl is None:
+            ydl = lazy_import('yt_dlp').YoutubeDL(opts)
+        ydl.params.update(params)
+        
+        try:
+            yield ydl
+        finally:
+            with self._lock:
+                idle = self._idle.setdefault(profile, [])
+                if len(idle) < self.max_idle_per_profile:
+                    idle.append(ydl)
+                    ydl = None
+            if ydl is not None:
+                ydl.close()
+
+    def prewarm(self, profile, opts):
+        """Build an idle instance ahead of time (loads the extractor registry)"""
+        ydl = lazy_import('yt_dlp').YoutubeDL(opts)
+        with self._lock:
+            self._idle.setdefault(profile, []).append(ydl)
+
+class WorkerError(Exception):
+    """A sandboxed media job failed, hit a resource limit or was killed"""
+
+    def __init__(self, message, limit=None):
+        super().__init__(message)
+        self.limit = limit  # 'memory', 'cpu' or 'timeout' when a limit killed the job
+
+WORKER_LIMIT_MESSAGES = {
+    'memory': "تجاوز التحميل حد الذاكرة المسموح به",
+    'cpu': "تجاوز التحميل حد المعالجة المسموح به",
+    'timeout': "استغرق التحميل وقتاً أطول من المسموح به",
+}
+
+def process_tree_rss(pid):
+    """Resident memory of pid and its descendants in bytes (0 where /proc is unavailable)"""
+    total = 0
+    pending = [pid]
+    while pending:
+        current = pending.pop()
+        try:
+            with open(f'/proc/{current}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1]) * 1024
+                        break
+            with open(f'/proc/{current}/task/{current}/children') as f:
+                pending.extend(int(child) for child in f.read().split())
+        except (OSError, ValueError):
+            continue
+    return total
+
+def kill_worker(proc):
+    """Kill a worker together with any ffmpeg it started (they share its process group)"""
+    with contextlib.suppress(ProcessLookupError):
+        os.killpg(proc.pid, signal.SIGKILL)
+
+class MediaWorkerPool:
+    """Long-lived sandboxed worker processes that keep yt-dlp loaded and its sessions warm"""
+
+    def __init__(self, size, max_jobs_per_worker):
+        self.size = size
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self._idle = []  # [(process, jobs run)]
+        self._semaphore = asyncio.Semaphore(size)
+
+    async def _spawn(self):
+        return await asyncio.create_subprocess_exec(
+            sys.executable, MEDIA_WORKER_SCRIPT, str(WORKER_MAX_MEMORY_BYTES), str(WORKER_MAX_CPU_SECONDS),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            start_new_session=True,  # Own process group so a kill also reaches ffmpeg
+            limit=4 * 1024 * 1024,  # Responses are single JSON lines
+        )
+
+    async def _retire(self, proc):
+        kill_worker(proc)
+        await proc.wait()
+
+    async def run(self, job, timeout=WORKER_TIMEOUT):
+        """Run one yt-dlp job on a warm worker and return its result"""
+        async with self._semaphore:
+            # Skip idle workers that died in the meantime (OOM killer, outside kill)
+            while self._idle and self._idle[-1][0].returncode is not None:
+                self._idle.pop()
+            proc, jobs_run = self._idle.pop() if self._idle else (await self._spawn(), 0)
+            stats = {'peak_rss_kb': 0, 'limit': None}
+            
+            async def watch_memory():
+                # RLIMIT_AS caps each process; this caps the resident memory of the whole tree
+                while proc.returncode is None:
+                    rss = process_tree_rss(proc.pid)
+                    stats['peak_rss_kb'] = max(stats['peak_rss_kb'], rss // 1024)
+                    if WORKER_MAX_RSS_BYTES and rss > WORKER_MAX_RSS_BYTES:
+                        stats['limit'] = 'memory'
+                        kill_worker(proc)
+                        return
+                    await asyncio.sleep(0.5)
+            
+            watchdog = asyncio.create_task(watch_memory())
+            started = time.perf_counter()
+            healthy = False
+            try:
+                try:
+                    proc.stdin.write(json.dumps(job).encode() + b'\n')
+                    await proc.stdin.drain()
+                    line = await asyncio.wait_for(proc.stdout.readline(), timeout)
+                except asyncio.TimeoutError:
+                    stats['limit'] = 'timeout'
+                    line = b''
+                except ConnectionError:
+                    line = b''
+                
+                try:
+                    response = json.loads(line) if line else {}
+                except ValueError:
+                    response = {}
+                # A worker that hit a limit (or answered garbage) is recycled, not reused
+                healthy = bool(response) and not stats['limit'] and not response.get('limit')
+            finally:
+                # Also runs on cancellation: an abandoned job's worker is killed with its ffmpeg
+                watchdog.cancel()
+                if healthy and jobs_run + 1 < self.max_jobs_per_worker:
+                    self._idle.append((proc, jobs_run + 1))
+                else:
+                    await self._retire(proc)
+        
+        usage = response.get('usage') or {}
+        limit = stats['limit'] or response.get('limit')
+        exit_code = None if healthy else proc.returncode
+        if limit is None and exit_code == -signal.SIGXCPU:
+            limit = 'cpu'  # RLIMIT_CPU soft limit; a SIGKILL may just as well be the OOM killer
+        
+        logger.log(
+            logging.WARNING if limit or not response else logging.INFO,
+            "Media worker %s finished%s", job['action'], f" ({limit} limit)" if limit else "",
+            extra={
+                'url': job.get('url'),
+                'duration_ms': round((time.perf_counter() - started) * 1000),
+                'peak_rss_kb': stats['peak_rss_kb'],
+                'cpu_seconds': usage.get('cpu_seconds'),
+            }
+        )
+        
+        if limit:
+            raise WorkerError(f"{limit} limit exceeded", limit=limit)
+        if 'error' in response:
+            raise WorkerError(response['error'])
+        if not response:
+            if exit_code and exit_code < 0:
+                raise WorkerError(f"worker killed by {signal.Signals(-exit_code).name}")
+            raise WorkerError(f"worker exited with code {exit_code}")
+        return response.get('result')
+
+    async def prewarm(self, opts):
+        """Start a worker and load yt-dlp plus a video YoutubeDL instance in it"""
+        await self.run({'action': 'warm', 'profile': 'video', 'opts': opts})
+
+    async def close(self):
+        """Stop the idle workers (busy ones are killed when their jobs are cancelled)"""
+        while self._idle:
+            proc, _ = self._idle.pop()
+            await self._retire(proc)
+
+media_workers = MediaWorkerPool(WORKER_POOL_SIZE, WORKER_MAX_JOBS)
+
 class VideoDownloader:
     def __init__(self):
         self.ydl_opts = {
             'format': 'best[height<=720]/best',
             'outtmpl': '%(title)s.%(ext)s',
             'noplaylist': True,
-            'extractaudio': False,
-            'audioformat': 'mp3',
             'embed_subs': False,
             'writesubtitles': False,
             'writeautomaticsub': False,
@@ -62,50 +676,136 @@ class VideoDownloader:
             'writeinfojson': False,
             'quiet': False,
             'verbose': False,
+            # Progressive files are fetched in HTTP range chunks
+            'http_chunk_size': HTTP_CHUNK_SIZE,
         }
+        # Audio-only mode: pick an audio stream and remux it (stream copy) instead of re-encoding
+        self.audio_overrides = {
+            'format': 'bestaudio[ext=m4a]/bestaudio[acodec=opus]/bestaudio/best',
+            'postprocessors': [{
+                'key': 'FFmpegExtractAudio',
+                'preferredcodec': 'best',
+            }],
+        }
+        
+        # Optional external downloader backend for HLS/DASH and large files
+        self.external_downloader = None
+        if EXTERNAL_DOWNLOADER:
+            if shutil.which(EXTERNAL_DOWNLOADER):
+                self.external_downloader = EXTERNAL_DOWNLOADER
+                self.ydl_opts['external_downloader'] = {'default': EXTERNAL_DOWNLOADER}
+            else:
+                logger.warning("External downloader %s not found, using the native one", EXTERNAL_DOWNLOADER)
+        
+        self.pool = YoutubeDLPool()
+        self._stream_cache = OrderedDict()  # url -> (expires_at, track)
     
-    async def download_video(self, url, output_path=None):
-        """Download video from URL using yt-dlp"""
+    def _build_opts(self, **overrides):
+        """Per-call copy of the yt-dlp options so concurrent jobs never share state"""
+        opts = dict(self.ydl_opts)
+        opts.update(overrides)
+        return opts
+
+    def _download_params(self, output_path, fragments):
+        """Per-job parameters: output directory, size cap and fragment concurrency share"""
+        params = {
+            'paths': {'home': output_path or '.'},
+            # Skip or abort oversize files instead of downloading them only to delete them
+            'max_filesize': MAX_FILE_SIZE_BYTES,
+            'concurrent_fragment_downloads': fragments,
+        }
+        if self.external_downloader == 'aria2c':
+            params['external_downloader_args'] = {
+                # -j is what bounds parallel fragments of HLS/DASH lists; Aria2cFD defaults it to 16
+                'aria2c': ['-x', str(fragments), '-s', str(fragments), '-j', str(fragments), '-k', '1M']
+            }
+        return params
+
+    def _download_sync(self, url, output_path, opts, params, audio=False, clip=None):
+        """Blocking yt-dlp download, run in a worker thread"""
+        with self.pool.acquire('audio' if audio else 'video', opts, **params) as ydl:
+            return media_worker.download(ydl, url, output_path, MAX_FILE_SIZE_BYTES, MAX_MEDIA_DURATION, clip)
+
+    async def download_video(self, url, output_path=None, audio=False, fragments=FRAGMENT_CONCURRENCY, clip=None):
+        """Download a video, only its audio, or only a clip=(start, end) of it without blocking the event loop"""
+        opts = self._build_opts(**(self.audio_overrides if audio else {}))
+        params = self._download_params(output_path, fragments)
         try:
-            if output_path:
-                self.ydl_opts['outtmpl'] = os.path.join(output_path, '%(title)s.%(ext)s')
-            
-            with yt_dlp.YoutubeDL(self.ydl_opts) as ydl:
-                # Extract info first
-                info = ydl.extract_info(url, download=False)
-                title = info.get('title', 'Unknown')
-                duration = info.get('duration', 0)
-                
-                # Check file size and duration limits
-                if duration and duration > 600:  # 10 minutes limit
-                    return None, "فيديو طويل جداً (أكثر من 10 دقائق)"
-                
-                # Download the video
-                ydl.download([url])
-                
-                # Find the downloaded file
-                for file in os.listdir(output_path or '.'):
-                    if title.replace('/', '_').replace('\\', '_') in file or any(ext in file for ext in ['.mp4', '.mkv', '.webm', '.avi']):
-                        file_path = os.path.join(output_path or '.', file)
-                        file_size = os.path.getsize(file_path)
-                        
-                        # Discord file size limit (8MB for free, 50MB for Nitro)
-                        if file_size > 8 * 1024 * 1024:  # 8MB limit
-                            os.remove(file_path)
-                            return None, "حجم الملف كبير جداً (أكثر من 8 ميجابايت)"
-                        
-                        return file_path, None
-                
-                return None, "لم يتم العثور على الملف المحمل"
-                
+            if WORKER_SANDBOX:
+                file_path, error = await media_workers.run({
+                    'action': 'download',
+                    'profile': 'audio' if audio else 'video',
+                    'url': url,
+                    'output_path': output_path,
+                    'opts': opts,
+                    'params': params,
+                    'max_file_size': MAX_FILE_SIZE_BYTES,
+                    'max_duration': MAX_MEDIA_DURATION,
+                    'clip': clip,
+                })
+                return file_path, error
+            return await asyncio.to_thread(self._download_sync, url, output_path, opts, params, audio, clip)
         except Exception as e:
-            logger.error(f"Error downloading video: {str(e)}")
+            logger.error("Error downloading video: %s", e, extra={'url': url})
+            if isinstance(e, WorkerError) and e.limit:
+                return None, WORKER_LIMIT_MESSAGES[e.limit]
             return None, f"خطأ في التحميل: {str(e)}"
 
+    def _extract_entries_sync(self, url, limit, opts):
+        """Blocking flat extraction of a playlist, run in a worker thread"""
+        with self.pool.acquire('flat', opts, playlistend=limit) as ydl:
+            return media_worker.list_entries(ydl, url, limit)
+
+    async def extract_entries(self, url, limit):
+        """List entry URLs of a playlist without resolving formats (extract_flat)"""
+        opts = self._build_opts(extract_flat='in_playlist', noplaylist=False, quiet=True)
+        try:
+            if WORKER_SANDBOX:
+                return await media_workers.run({
+                    'action': 'entries',
+                    'profile': 'flat',
+                    'url': url,
+                    'limit': limit,
+                    'opts': opts,
+                    'params': {'playlistend': limit},
+                })
+            return await asyncio.to_thread(self._extract_entries_sync, url, limit, opts)
+        except Exception as e:
+            logger.error(f"Error extracting playlist: {str(e)}")
+            return []
+
+    def _resolve_stream_sync(self, url, opts):
+        """Blocking extraction of a direct audio stream URL, run in a worker thread"""
+        with self.pool.acquire('stream', opts) as ydl:
+            return media_worker.resolve_stream(ydl, url)
+
+    async def resolve_stream(self, url):
+        """Resolve a playable stream for url, cached until the signed URL is likely stale"""
+        cached = self._stream_cache.get(url)
+        if cached and cached[0] > time.monotonic():
+            self._stream_cache.move_to_end(url)
+            return cached[1]
+        
+        opts = self._build_opts(format='bestaudio[acodec=opus]/bestaudio/best', quiet=True)
+        try:
+            if WORKER_SANDBOX:
+                track = await media_workers.run({'action': 'stream', 'url': url, 'opts': opts})
+            else:
+                track = await asyncio.to_thread(self._resolve_stream_sync, url, opts)
+        except Exception as e:
+            logger.error(f"Error resolving stream: {str(e)}")
+            return None
+        
+        if track:
+            self._stream_cache[url] = (time.monotonic() + STREAM_CACHE_TTL, track)
+            while len(self._stream_cache) > 256:
+                self._stream_cache.popitem(last=False)
+        return track
+
     def get_supported_sites(self):
         """Get list of supported sites"""
         try:
-            with yt_dlp.YoutubeDL() as ydl:
+            with lazy_import('yt_dlp').YoutubeDL() as ydl:
                 extractors = ydl.list_extractors()
                 return [extractor.IE_NAME for extractor in extractors[:50]]  # First 50 sites
         except:
@@ -113,17 +813,268 @@ class VideoDownloader:
 
 downloader = VideoDownloader()
 
-async def send_update_notification(title, description, color=0x00ff00, fields=None):
-    """Send update notification to designated channel"""
-    if not UPDATE_CHANNEL_ID:
-        return
+class DownloadScheduler:
+    """Global concurrency limit for media jobs with disk-pressure backpressure"""
+
+    def __init__(self, max_concurrent, storage, fragment_budget, pressure_wait=30):
+        self.max_concurrent = max_concurrent
+        self.storage = storage
+        self.fragment_budget = fragment_budget
+        self.fragments_in_use = 0
+        self.pressure_wait = pressure_wait
+        self.active = 0
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._guild_active = {}  # guild id -> running jobs
+        self._guild_condition = asyncio.Condition()
+
+    @contextlib.asynccontextmanager
+    async def _guild_slot(self, guild_id, limit):
+        """Per-guild quota so one busy guild cannot take every global slot"""
+        async with self._guild_condition:
+            await self._guild_condition.wait_for(lambda: self._guild_active.get(guild_id, 0) < limit)
+            self._guild_active[guild_id] = self._guild_active.get(guild_id, 0) + 1
+        try:
+            yield
+        finally:
+            async with self._guild_condition:
+                self._guild_active[guild_id] -= 1
+                if not self._guild_active[guild_id]:
+                    del self._guild_active[guild_id]
+                self._guild_condition.notify_all()
+
+    @contextlib.asynccontextmanager
+    async def slot(self, fragments=FRAGMENT_CONCURRENCY, guild_id=None, guild_limit=None):
+        """Wait for a free job slot and disk headroom; yields the job's fragment concurrency"""
+        async with contextlib.AsyncExitStack() as stack:
+            if guild_id is not None and guild_limit:
+                await stack.enter_async_context(self._guild_slot(guild_id, guild_limit))
+            await stack.enter_async_context(self._semaphore)
+            
+            waited = 0
+            while self.storage.under_pressure() and waited < self.pressure_wait:
+                await asyncio.sleep(1)
+                waited += 1
+            
+            # Share the global connection budget so parallel jobs don't oversubscribe bandwidth
+            share = max(1, min(fragments, self.fragment_budget - self.fragments_in_use))
+            self.fragments_in_use += share
+            self.active += 1
+            try:
+                yield share
+            finally:
+                self.active -= 1
+                self.fragments_in_use -= share
+
+scheduler = DownloadScheduler(MAX_CONCURRENT_DOWNLOADS, storage, MAX_FRAGMENT_CONNECTIONS)
+
+def pack_attachments(paths, max_bytes, max_count=MAX_ATTACHMENTS_PER_MESSAGE):
+    """Group files into message-sized batches by count and total size"""
+    batches = []
+    current = []
+    current_size = 0
     
-    try:
-        channel = bot.get_channel(int(UPDATE_CHANNEL_ID))
-        if not channel:
-            logger.warning(f"Update channel {UPDATE_CHANNEL_ID} not found")
+    for path in paths:
+        size = os.path.getsize(path)
+        if current and (len(current) >= max_count or current_size + size > max_bytes):
+            batches.append(current)
+            current = []
+            current_size = 0
+        current.append(path)
+        current_size += size
+    
+    if current:
+        batches.append(current)
+    return batches
+
+async def create_stream_source(track):
+    """Build a voice source that streams from the remote URL without touching disk"""
+    url = track['stream_url']
+    acodec = track.get('acodec') or ''
+    
+    # Opus sources are passed through untouched, so no transcoding CPU is spent
+    if acodec.startswith('opus'):
+        return discord.FFmpegOpusAudio(
+            url, codec='copy',
+            before_options=FFMPEG_STREAM_BEFORE_OPTIONS, options=FFMPEG_STREAM_OPTIONS
+        )
+    
+    # Unknown codec: let ffprobe decide between copy and encode
+    if not acodec or acodec == 'none':
+        return await discord.FFmpegOpusAudio.from_probe(
+            url, before_options=FFMPEG_STREAM_BEFORE_OPTIONS, options=FFMPEG_STREAM_OPTIONS
+        )
+    
+    # Other codecs are encoded to Opus inside ffmpeg, not in the bot process
+    return discord.FFmpegOpusAudio(
+        url, before_options=FFMPEG_STREAM_BEFORE_OPTIONS, options=FFMPEG_STREAM_OPTIONS
+    )
+
+class GuildPlayer:
+    """Per-guild queue that streams tracks into the guild's voice connection"""
+
+    def __init__(self, guild, text_channel):
+        self.guild = guild
+        self.text_channel = text_channel
+        self.tracks = deque()
+        self.current = None
+        self._wakeup = asyncio.Event()
+        self._track_done = asyncio.Event()
+        self._destroyed = False
+        self._task = asyncio.create_task(self._player_loop())
+
+    def enqueue(self, track):
+        """Add a track; returns its queue position or None when the queue is full"""
+        if len(self.tracks) >= MAX_QUEUE_SIZE:
+            return None
+        self.tracks.append(track)
+        self._wakeup.set()
+        return len(self.tracks)
+
+    def is_busy(self):
+        return self.current is not None or bool(self.tracks)
+
+    def skip(self):
+        """Stop the current track so the next one starts"""
+        voice_client = self.guild.voice_client
+        if voice_client and voice_client.is_playing():
+            voice_client.stop()
+            return True
+        return False
+
+    def clear(self):
+        self.tracks.clear()
+
+    async def _play_track(self, track):
+        voice_client = self.guild.voice_client
+        if not voice_client or not voice_client.is_connected():
+            logger.warning("Dropping track: voice not connected", extra={'guild': self.guild.id})
             return
         
+        # Refresh through the cache in case the signed URL expired while queued
+        fresh = await downloader.resolve_stream(track['webpage_url']) or track
+        source = await create_stream_source(fresh)
+        
+        loop = asyncio.get_running_loop()
+        
+        def after_playback(error):
+            if error:
+                logger.error(f"Playback error in guild {self.guild.id}: {str(error)}")
+            loop.call_soon_threadsafe(self._track_done.set)
+        
+        self._track_done.clear()
+        self.current = track
+        voice_client.play(source, after=after_playback)
+        
+        try:
+            await self.text_channel.send(f"🎶 يتم التشغيل الآن: **{track['title']}**")
+        except discord.HTTPException:
+            pass
+        
+        await self._track_done.wait()
+
+    async def _player_loop(self):
+        try:
+            while True:
+                if not self.tracks:
+                    self._wakeup.clear()
+                    try:
+                        idle_timeout = settings.get(self.guild.id, 'voice_idle_timeout', VOICE_IDLE_TIMEOUT)
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=idle_timeout)
+                    except asyncio.TimeoutError:
+                        logger.info(f"Voice idle timeout in guild {self.guild.id}")
+                        break
+                    continue
+                
+                track = self.tracks.popleft()
+                try:
+                    await self._play_track(track)
+                except Exception as e:
+                    logger.error(f"Failed to play track in guild {self.guild.id}: {str(e)}")
+                    try:
+                        await self.text_channel.send(f"❌ تعذر تشغيل: **{track['title']}**")
+                    except discord.HTTPException:
+                        pass
+                finally:
+                    self.current = None
+        finally:
+            if players.get(self.guild.id) is self:
+                del players[self.guild.id]
+            voice_client = self.guild.voice_client
+            if voice_client and voice_client.is_connected() and not self._destroyed:
+                try:
+                    await voice_client.disconnect(force=True)
+                except Exception as e:
+                    logger.warning(f"Error disconnecting idle voice client: {str(e)}")
+
+    async def destroy(self):
+        """Stop playback and tear the player down"""
+        self.clear()
+        self._destroyed = True
+        self._task.cancel()
+        if players.get(self.guild.id) is self:
+            del players[self.guild.id]
+        voice_client = self.guild.voice_client
+        if voice_client and voice_client.is_playing():
+            voice_client.stop()
+
+players = {}  # guild id -> GuildPlayer
+
+def get_player(ctx):
+    """Return the guild's player, creating it on first use"""
+    player = players.get(ctx.guild.id)
+    if player is None:
+        player = GuildPlayer(ctx.guild, ctx.channel)
+        players[ctx.guild.id] = player
+    player.text_channel = ctx.channel
+    return player
+
+def update_channel_ids(guild=None):
+    """Update channels for one guild, or for every configured guild when guild is None"""
+    if guild is not None:
+        channel_id = settings.get(guild.id, 'update_channel_id')
+        if channel_id:
+            return [channel_id]
+        # Fall back to the global channel when it lives in this guild
+        channel = bot.get_channel(UPDATE_CHANNEL_ID) if UPDATE_CHANNEL_ID else None
+        return [UPDATE_CHANNEL_ID] if channel and channel.guild.id == guild.id else []
+    
+    channel_ids = set(settings.values('update_channel_id').values())
+    if UPDATE_CHANNEL_ID:
+        channel_ids.add(UPDATE_CHANNEL_ID)
+    return sorted(channel_ids)
+
+async def broadcast_embed(embed, channel_ids):
+    """Send embed to many channels concurrently, in rate-limit friendly batches"""
+    async def send_one(channel_id):
+        channel = bot.get_channel(channel_id)
+        if not channel:
+            logger.warning("Update channel %s not found", channel_id)
+            return False
+        try:
+            await channel.send(embed=embed)
+            return True
+        except discord.HTTPException as e:
+            logger.warning("Failed to send update notification to %s: %s", channel_id, e)
+            return False
+    
+    delivered = 0
+    for start in range(0, len(channel_ids), BROADCAST_BATCH_SIZE):
+        if start:
+            await asyncio.sleep(BROADCAST_BATCH_DELAY)
+        batch = channel_ids[start:start + BROADCAST_BATCH_SIZE]
+        delivered += sum(await asyncio.gather(*(send_one(channel_id) for channel_id in batch)))
+    
+    logger.info("Update notification delivered to %d/%d channels", delivered, len(channel_ids))
+    return delivered
+
+async def send_update_notification(title, description, color=0x00ff00, fields=None, guild=None):
+    """Send update notification to a guild's update channel, or to all of them when guild is None.
+    Returns True when it was delivered at least once."""
+    channel_ids = update_channel_ids(guild)
+    if not channel_ids:
+        return False
+    
+    try:
         embed = discord.Embed(
             title=f"🔄 {title}",
             description=description,
@@ -141,16 +1092,16 @@ async def send_update_notification(title, description, color=0x00ff00, fields=No
                     inline=field.get('inline', False)
                 )
         
-        await channel.send(embed=embed)
-        logger.info(f"Update notification sent to channel {UPDATE_CHANNEL_ID}")
+        return await broadcast_embed(embed, channel_ids) > 0
         
     except Exception as e:
         logger.error(f"Failed to send update notification: {str(e)}")
+        return False
 
 async def send_automatic_update_notification():
-    """Send automatic update notification based on version and features"""
-    if not UPDATE_CHANNEL_ID:
-        return
+    """Send automatic update notification based on version and features; returns True when delivered"""
+    if not update_channel_ids():
+        return False
     
     # Define current update details
     update_details = {
@@ -179,7 +1130,7 @@ async def send_automatic_update_notification():
     }
     
     try:
-        await send_update_notification(
+        delivered = await send_update_notification(
             title=update_details["title"],
             description=f"الإصدار {update_details['version']} - {update_details['description']}",
             color=0x00ff00,
@@ -217,6 +1168,9 @@ async def send_automatic_update_notification():
             ]
         )
         
+        if not delivered:
+            return False
+        
         # Send welcome message after update notification
         await asyncio.sleep(2)  # Wait 2 seconds
         
@@ -238,29 +1192,240 @@ async def send_automatic_update_notification():
             ]
         )
         
+        return True
+        
     except Exception as e:
         logger.error(f"Failed to send automatic update notification: {str(e)}")
+        return False
+
+class DrainingError(commands.CheckFailure):
+    """Raised for new commands once the bot has started draining for a restart"""
+
+class JobHandle:
+    """A single resumable unit of work (one URL of a batch, one queued track)"""
+
+    def __init__(self, tracker, job):
+        self.tracker = tracker
+        self.job = job
+        self.task = asyncio.current_task()
+        self.started = False
+
+    def start(self):
+        """The job got its slot; from now on a drain waits for it instead of postponing it"""
+        self.started = True
+
+class JobTracker:
+    """Tracks in-flight work so a shutdown can drain it instead of dropping it"""
+
+    def __init__(self):
+        self.accepting = True
+        self._operations = {}  # command task -> (guild id, user id) of whoever invoked it
+        self._handles = set()
+        self.postponed = []  # resumable jobs handed to the next instance
+        self.cut_off = []  # jobs that were running when the deadline hit
+
+    def begin_operation(self, owner=None):
+        task = asyncio.current_task()
+        self._operations[task] = owner
+        # after_invoke is skipped for slash commands that fail or are cancelled, so the task
+        # itself removes its entry when it ends
+        task.add_done_callback(self._forget_operation)
+
+    def end_operation(self):
+        self._operations.pop(asyncio.current_task(), None)
+
+    def _forget_operation(self, task):
+        self._operations.pop(task, None)
+
+    def cancel_operations(self, owner):
+        """Cancel the running commands of one user; returns how many were cancelled"""
+        current = asyncio.current_task()
+        tasks = [
+            task for task, task_owner in self._operations.items()
+            if task_owner == owner and task is not current and not task.done()
+        ]
+        for task in tasks:
+            task.cancel()
+        return len(tasks)
+
+    @contextlib.contextmanager
+    def job(self, job):
+        """Register a resumable job for the current task"""
+        handle = JobHandle(self, job)
+        self._handles.add(handle)
+        try:
+            yield handle
+        finally:
+            self._handles.discard(handle)
+
+    def registered_jobs(self):
+        """Every job that is queued or running right now"""
+        return [handle.job for handle in self._handles]
+
+    def postpone(self, handle):
+        """Record a job interrupted by the drain so the next instance runs it again"""
+        self.postponed.append(handle.job)
+        if handle.started:
+            self.cut_off.append(handle.job)
+
+    async def drain(self, timeout):
+        """Stop accepting work, postpone queued jobs and give running ones until timeout"""
+        self.accepting = False
+        
+        # Jobs still waiting for a scheduler slot would only start now; hand them over instead
+        for handle in list(self._handles):
+            if not handle.started and handle.task:
+                handle.task.cancel()
+        
+        running = [task for task in self._operations if not task.done()]
+        if not running:
+            return
+        
+        logger.info("Draining %d running operations (deadline %ds)", len(running), timeout)
+        _, unfinished = await asyncio.wait(running, timeout=timeout)
+        for task in unfinished:
+            task.cancel()
+        if unfinished:
+            await asyncio.wait(unfinished, timeout=5)
+
+jobs = JobTracker()
+
+class ConnectionLifecycle:
+    """Tells the first gateway session apart from resumes and remembers what was announced"""
+
+    def __init__(self, state_file):
+        self.state_file = state_file
+        self.ready_count = 0
+        self.disconnect_count = 0
+        self.shutting_down = False
+        self.state = self._load_state()
+
+    def _load_state(self):
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not read state file {self.state_file}: {str(e)}")
+            return {}
+
+    def _save_state(self):
+        # Write to a temp file and rename so a crash never leaves a half-written state
+        tmp_path = f"{self.state_file}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.state_file)
+
+    def _update_state(self, **changes):
+        """Apply changes (None removes a key) on top of a fresh read and write the file back"""
+        # During an overlapping restart the other instance may have written since we loaded
+        state = self._load_state()
+        for key, value in changes.items():
+            if value is None:
+                state.pop(key, None)
+            else:
+                state[key] = value
+        self.state = state
+        self._save_state()
+
+    def on_ready(self):
+        """Record a READY event; returns True only for the first one of this process"""
+        self.ready_count += 1
+        return self.ready_count == 1
+
+    def needs_version_notification(self, version):
+        return self.state.get('last_notified_version') != version
+
+    async def mark_version_notified(self, version):
+        try:
+            await asyncio.to_thread(self._update_state, last_notified_version=version)
+        except OSError as e:
+            logger.warning(f"Could not persist state file {self.state_file}: {str(e)}")
+
+    def save_pending_jobs(self, pending):
+        """Persist jobs for the next instance (called during shutdown)"""
+        try:
+            self._update_state(pending_jobs=pending or None)
+        except OSError as e:
+            logger.error(f"Could not persist {len(pending)} pending jobs: {str(e)}")
+
+    async def take_pending_jobs(self):
+        """Return and clear the jobs left by the previous instance"""
+        # Re-read: the previous instance writes its jobs while this one is already starting up
+        self.state = await asyncio.to_thread(self._load_state)
+        pending = self.state.get('pending_jobs', [])
+        if pending:
+            try:
+                await asyncio.to_thread(self._update_state, pending_jobs=None)
+            except OSError as e:
+                logger.warning(f"Could not persist state file {self.state_file}: {str(e)}")
+        return pending
+
+lifecycle = ConnectionLifecycle(BOT_STATE_FILE)
+
+async def warm_up_media():
+    """Load the media subsystems in worker threads once the bot is already online"""
+    try:
+        # Sandboxed jobs run in long-lived workers, so warm one of those instead of this process
+        if WORKER_SANDBOX:
+            await media_workers.prewarm(downloader._build_opts())
+        else:
+            await asyncio.to_thread(downloader.pool.prewarm, 'video', downloader._build_opts())
+        startup_timer.mark('yt_dlp warm')
+        await asyncio.to_thread(lazy_import, 'gtts')
+        startup_timer.mark('gtts warm')
+    except Exception as e:
+        logger.error(f"Media warm-up failed: {str(e)}")
+    logger.info("Startup timing: %s", startup_timer.report())
+
+@bot.event
+async def setup_hook():
+    """Start background services once, before connecting to the gateway"""
+    startup_timer.mark('setup_hook')
+    install_signal_handlers()
+    await settings.load()
+    storage.start_janitor(MEDIA_JANITOR_INTERVAL)
+    
+    # Global sync is rate limited, so only do it when asked to (or via !sync)
+    if SYNC_COMMANDS_ON_STARTUP:
+        synced = await bot.tree.sync()
+        logger.info("Synced %d application commands", len(synced))
 
 @bot.event
 async def on_ready():
+    # READY fires again whenever the gateway has to re-identify; only the first one sets things up
+    if not lifecycle.on_ready():
+        logger.info(f"Gateway session re-established (ready #{lifecycle.ready_count})")
+        return
+    
     logger.info(f'{bot.user} has connected to Discord!')
     print(f'{bot.user} متصل بنجاح!')
+    startup_timer.mark('gateway ready')
     
-    # Set bot status
-    await bot.change_presence(
-        activity=discord.Activity(
-            type=discord.ActivityType.watching,
-            name="!download للمساعدة"
-        )
-    )
+    # Heavy media modules load in the background; commands like !ping work immediately
+    asyncio.create_task(warm_up_media())
+    
+    # Pick up whatever the previous instance could not finish before it restarted
+    asyncio.create_task(resume_pending_jobs())
     
-    # Send automatic update notification
-    await send_automatic_update_notification()
+    # Send automatic update notification once per version, not on every restart
+    if lifecycle.needs_version_notification(BOT_VERSION):
+        if await send_automatic_update_notification():
+            await lifecycle.mark_version_notified(BOT_VERSION)
+
+@bot.event
+async def on_resumed():
+    logger.info("Gateway session resumed")
 
 async def cleanup_connections():
-    """Clean up all connections and resources"""
+    """Release voice and HTTP resources; only called on real shutdown"""
     logger.info("Starting cleanup process...")
     
+    # Stop music players before their voice connections go away
+    for player in list(players.values()):
+        await player.destroy()
+    
     # Clean up voice connections
     for voice_client in bot.voice_clients:
         try:
@@ -284,13 +1449,46 @@ async def cleanup_connections():
 
 @bot.event
 async def on_disconnect():
-    """Clean up when bot disconnects"""
-    logger.info("Bot disconnecting - starting cleanup")
-    await cleanup_connections()
+    """Gateway dropped; discord.py resumes on its own, so pooled resources are kept"""
+    lifecycle.disconnect_count += 1
+    if not lifecycle.shutting_down:
+        logger.info("Gateway disconnected (#%d) - waiting for resume", lifecycle.disconnect_count)
+
+@bot.before_invoke
+async def before_any_command(ctx):
+    """Tag every log record emitted while handling this command"""
+    bind_log_context(guild=ctx.guild.id if ctx.guild else None, command=ctx.command.qualified_name)
+    ctx.started_at = time.perf_counter()
+    jobs.begin_operation((ctx.guild.id if ctx.guild else None, ctx.author.id))
+    # Logged when the task ends rather than in after_invoke, which failed slash commands skip;
+    # the callback runs in a copy of this context, so the guild/command fields stay attached
+    asyncio.current_task().add_done_callback(lambda task: log_command_finished(ctx, task))
+
+def log_command_finished(ctx, task):
+    """Structured timing record for every command, however it ended"""
+    if task.cancelled():
+        outcome = "cancelled"
+    elif ctx.command_failed:
+        outcome = "failed"
+    else:
+        outcome = "completed"
+    logger.info(
+        f"Command {outcome}",
+        extra={'duration_ms': round((time.perf_counter() - ctx.started_at) * 1000)}
+    )
+
+@bot.check
+async def reject_while_draining(ctx):
+    """Refuse new commands once a shutdown drain has started"""
+    if not jobs.accepting:
+        raise DrainingError()
+    return True
 
 @bot.event
 async def on_command_error(ctx, error):
-    if isinstance(error, commands.CommandNotFound):
+    if isinstance(error, DrainingError):
+        await ctx.send("🔄 البوت يعيد التشغيل الآن، جرب مرة أخرى بعد قليل")
+    elif isinstance(error, commands.CommandNotFound):
         await ctx.send("❌ أمر غير معروف! استخدم `!help` لرؤية الأوامر المتاحة")
     elif isinstance(error, commands.MissingRequiredArgument):
         await ctx.send("❌ معطى مفقود! تأكد من إدخال الرابط")
@@ -298,61 +1496,268 @@ async def on_command_error(ctx, error):
         logger.error(f"Command error: {error}")
         await ctx.send(f"❌ حدث خطأ: {str(error)}")
 
-@bot.command(name='download', aliases=['dl', 'تحميل'])
-async def download_video(ctx, url: str = None):
-    """Download video from supported platforms"""
-    if not url:
-        embed = discord.Embed(
-            title="📥 تحميل الفيديوهات",
-            description="استخدم: `!download [رابط الفيديو]`\n\nمثال:\n`!download https://youtube.com/watch?v=...`",
-            color=0x00ff00
-        )
-        await ctx.send(embed=embed)
+async def run_download_batch(ctx, urls, playlist=False, audio=False, clip=None):
+    """Download several URLs in parallel and deliver them in batched messages"""
+    # Acknowledge slash invocations right away; the download can take far longer than 3 seconds
+    await ctx.defer()
+    
+    # Refuse instead of silently dropping the URLs past the cap
+    if not playlist and len(urls) > MAX_BATCH_ITEMS:
+        await ctx.send(f"❌ الحد الأقصى {MAX_BATCH_ITEMS} روابط في الطلب الواحد (أرسلت {len(urls)})")
+        return
+    
+    # Back off early instead of starting a download the disk cannot hold
+    if storage.under_pressure():
+        await ctx.send("⏳ البوت مشغول حالياً، جرب مرة أخرى بعد قليل")
         return
     
     # Send initial message
     loading_msg = await ctx.send("⏳ جاري التحميل...")
     
     try:
-        # Create temporary directory
-        with tempfile.TemporaryDirectory() as temp_dir:
-            # Download video
-            file_path, error = await downloader.download_video(url, temp_dir)
+        # Expand playlists with a cheap flat extraction before downloading anything
+        if playlist:
+            targets = []
+            for url in urls:
+                targets.extend(await downloader.extract_entries(url, MAX_BATCH_ITEMS - len(targets)))
+                if len(targets) >= MAX_BATCH_ITEMS:
+                    break
+        else:
+            targets = urls
+        
+        if not targets:
+            await loading_msg.edit(content="❌ لم يتم العثور على أي فيديو في الروابط")
+            return
+        
+        upload_limit = ctx.guild.filesize_limit if ctx.guild else MAX_FILE_SIZE_BYTES
+        guild_id = ctx.guild.id if ctx.guild else None
+        limit_override = settings.get(guild_id, 'upload_limit_mb')
+        if limit_override:
+            upload_limit = min(upload_limit, limit_override * 1024 * 1024)
+        guild_quota = settings.get(guild_id, 'max_concurrent_jobs')
+        results = [(None, None)] * len(targets)
+        completed = 0
+        
+        # Workspaces stay alive until every batch has been uploaded
+        with contextlib.ExitStack() as workspaces:
+            def postpone(handle, index):
+                # Drain: the next instance picks this URL up again
+                jobs.postpone(handle)
+                results[index] = (None, "⏸️ تم تأجيله بسبب إعادة تشغيل البوت وسيُستكمل تلقائياً")
             
-            if error:
-                await loading_msg.edit(content=f"❌ {error}")
-                return
+            async def run_one(index, url):
+                nonlocal completed
+                bind_log_context(job_id=uuid.uuid4().hex[:8], url=url)
+                job = {
+                    'kind': 'audio' if audio else 'download',
+                    'url': url,
+                    'channel_id': ctx.channel.id,
+                    'requester': ctx.author.display_name,
+                }
+                if clip:
+                    job['clip'] = list(clip)
+                with jobs.job(job) as handle:
+                    # The drain only cancels handles that existed when it started; a playlist
+                    # still being expanded at that point registers its items afterwards
+                    if not jobs.accepting:
+                        postpone(handle, index)
+                        return
+                    try:
+                        await run_job(handle, index, url)
+                    except asyncio.CancelledError:
+                        if jobs.accepting:
+                            raise
+                        postpone(handle, index)
+                        return
+                
+                completed += 1
+                if len(targets) > 1:
+                    try:
+                        await loading_msg.edit(content=f"⏳ جاري التحميل... ({completed}/{len(targets)})")
+                    except discord.HTTPException:
+                        pass
             
-            if not file_path or not os.path.exists(file_path):
-                await loading_msg.edit(content="❌ فشل في تحميل الفيديو")
-                return
+            async def run_job(handle, index, url):
+                async with scheduler.slot(guild_id=guild_id, guild_limit=guild_quota) as fragments:
+                    handle.start()
+                    try:
+                        temp_dir = workspaces.enter_context(storage.workspace(DOWNLOAD_RESERVE_BYTES))
+                    except StorageFullError as e:
+                        logger.warning("Download rejected: %s", e)
+                        results[index] = (None, "مساحة التخزين المؤقتة ممتلئة، جرب مرة أخرى بعد قليل")
+                        return
+                    
+                    started = time.perf_counter()
+                    file_path, error = await downloader.download_video(
+                        url, temp_dir, audio=audio, fragments=fragments, clip=clip
+                    )
+                    logger.info(
+                        "Download finished" if not error else "Download failed",
+                        extra={'duration_ms': round((time.perf_counter() - started) * 1000)}
+                    )
+                    if not error and (not file_path or not os.path.exists(file_path)):
+                        error = "فشل في تحميل الفيديو"
+                    elif not error and os.path.getsize(file_path) > upload_limit:
+                        error = "حجم الملف أكبر من حد الرفع في هذا السيرفر"
+                    results[index] = (file_path, error)
             
-            # Send the file
-            file_size = os.path.getsize(file_path)
-            file_size_mb = file_size / (1024 * 1024)
+            await asyncio.gather(*(run_one(i, url) for i, url in enumerate(targets)))
             
+            files = [path for path, error in results if not error]
+            failures = [(url, error) for url, (path, error) in zip(targets, results) if error]
+            
+            if not files:
+                if len(targets) == 1:
+                    await loading_msg.edit(content=f"❌ {failures[0][1]}")
+                else:
+                    lines = "\n".join(f"• <{url}>: {error}" for url, error in failures[:10])
+                    await loading_msg.edit(content=f"❌ فشل تحميل جميع الفيديوهات:\n{lines}")
+                return
+            
+            # Send the files
+            total_size_mb = sum(os.path.getsize(path) for path in files) / (1024 * 1024)
             embed = discord.Embed(
                 title="✅ تم التحميل بنجاح!",
-                description=f"📁 حجم الملف: {file_size_mb:.2f} ميجابايت",
+                description=f"📁 حجم الملف: {total_size_mb:.2f} ميجابايت",
                 color=0x00ff00,
                 timestamp=datetime.now()
             )
+            if len(targets) > 1:
+                embed.description = f"📦 تم تحميل {len(files)} من {len(targets)}\n📁 الحجم الكلي: {total_size_mb:.2f} ميجابايت"
+            if failures:
+                embed.add_field(
+                    name="❌ فشل التحميل",
+                    value="\n".join(f"• <{url}>: {error}" for url, error in failures[:10])[:1024],
+                    inline=False
+                )
             embed.set_footer(text=f"تم الطلب بواسطة {ctx.author.display_name}")
             
             await loading_msg.delete()
             
-            with open(file_path, 'rb') as f:
-                file = discord.File(f, filename=os.path.basename(file_path))
-                await ctx.send(embed=embed, file=file)
+            for i, batch in enumerate(pack_attachments(files, upload_limit)):
+                attachments = [discord.File(path, filename=os.path.basename(path)) for path in batch]
+                if i == 0:
+                    await ctx.send(embed=embed, files=attachments)
+                else:
+                    await ctx.send(files=attachments)
     
+    except asyncio.CancelledError:
+        # !cancel: the worker processes are already killed, just tell the user
+        if jobs.accepting:
+            with contextlib.suppress(discord.HTTPException):
+                await loading_msg.edit(content="🛑 تم إلغاء التحميل")
+        raise
     except Exception as e:
-        logger.error(f"Download command error: {str(e)}")
+        logger.error("Download command error: %s", e)
         await loading_msg.edit(content=f"❌ خطأ في التحميل: {str(e)}")
 
-@bot.command(name='sites', aliases=['مواقع'])
+def parse_timestamp(text):
+    """Seconds from 83, 1:23 or 1:02:03 (None if text is not a timestamp)"""
+    parts = text.split(':')
+    if len(parts) > 3 or not all(part.isdigit() for part in parts):
+        return None
+    # Only the leading field may exceed 59 (83 is fine, 1:99 is not)
+    if any(int(part) >= 60 for part in parts[1:]):
+        return None
+    seconds = 0
+    for part in parts:
+        seconds = seconds * 60 + int(part)
+    return seconds
+
+def parse_download_args(urls):
+    """Split command text into target URLs, the playlist flag and an optional (start, end) clip"""
+    args = urls.split() if urls else []
+    playlist = any(arg.lower() in PLAYLIST_FLAGS for arg in args)
+    targets = [arg.strip('<>') for arg in args if arg.lower() not in PLAYLIST_FLAGS]
+    
+    # `<url> <start> <end>` downloads only that section
+    clip = None
+    if len(targets) >= 3:
+        start, end = parse_timestamp(targets[-2]), parse_timestamp(targets[-1])
+        if start is not None and end is not None:
+            targets, clip = targets[:-2], (start, end)
+    return targets, playlist, clip
+
+def validate_clip(targets, playlist, clip):
+    """User-facing error for an unusable clip request, or None"""
+    start, end = clip
+    if playlist or len(targets) != 1:
+        return "❌ تحديد وقت البداية والنهاية متاح لرابط واحد فقط"
+    if end <= start:
+        return "❌ وقت النهاية يجب أن يكون بعد وقت البداية"
+    if end - start > MAX_MEDIA_DURATION:
+        return f"❌ المقطع طويل جداً (الحد الأقصى {MAX_MEDIA_DURATION // 60} دقائق)"
+    return None
+
+@bot.hybrid_command(name='download', aliases=['dl', 'تحميل'])
+@app_commands.describe(urls="رابط أو أكثر مفصولة بمسافات، أضف playlist لتحميل قائمة تشغيل، أو وقت البداية والنهاية لقص مقطع")
+async def download_video(ctx, *, urls: str = None):
+    """Download one or more videos, a playlist, or a clip of a long video or live stream"""
+    targets, playlist, clip = parse_download_args(urls)
+    
+    if not targets:
+        embed = discord.Embed(
+            title="📥 تحميل الفيديوهات",
+            description=(
+                "استخدم: `!download [رابط الفيديو] [رابط آخر...]`\n\n"
+                "مثال:\n`!download https://youtube.com/watch?v=...`\n\n"
+                f"لتحميل قائمة تشغيل (حتى {MAX_BATCH_ITEMS} فيديو):\n`!download playlist [رابط القائمة]`\n\n"
+                "لقص مقطع من فيديو طويل أو بث مباشر:\n`!download [رابط] 1:30 2:45`"
+            ),
+            color=0x00ff00
+        )
+        await ctx.send(embed=embed)
+        return
+    
+    if clip:
+        error = validate_clip(targets, playlist, clip)
+        if error:
+            await ctx.send(error)
+            return
+    
+    await run_download_batch(ctx, targets, playlist=playlist, clip=clip)
+
+@bot.hybrid_command(name='audio', aliases=['mp3', 'صوت'])
+@app_commands.describe(urls="رابط أو أكثر مفصولة بمسافات، أضف playlist لتحميل قائمة تشغيل، أو وقت البداية والنهاية لقص مقطع")
+async def download_audio(ctx, *, urls: str = None):
+    """Download only the audio track (m4a/opus, no re-encoding)"""
+    targets, playlist, clip = parse_download_args(urls)
+    
+    if not targets:
+        embed = discord.Embed(
+            title="🎵 تحميل الصوت فقط",
+            description=(
+                "استخدم: `!audio [رابط الفيديو] [رابط آخر...]`\n\n"
+                "مثال:\n`!audio https://youtube.com/watch?v=...`\n\n"
+                "الملفات الصوتية أصغر بكثير من الفيديو وتتحمل أسرع"
+            ),
+            color=0x00ff00
+        )
+        await ctx.send(embed=embed)
+        return
+    
+    if clip:
+        error = validate_clip(targets, playlist, clip)
+        if error:
+            await ctx.send(error)
+            return
+    
+    await run_download_batch(ctx, targets, playlist=playlist, audio=True, clip=clip)
+
+@bot.hybrid_command(name='cancel', aliases=['الغاء', 'إلغاء'])
+async def cancel_downloads(ctx):
+    """Cancel your running downloads in this server"""
+    cancelled = jobs.cancel_operations((ctx.guild.id if ctx.guild else None, ctx.author.id))
+    if cancelled:
+        await ctx.send(f"🛑 تم إلغاء {cancelled} من طلباتك الجارية")
+    else:
+        await ctx.send("❌ لا توجد طلبات جارية لإلغائها")
+
+@bot.hybrid_command(name='sites', aliases=['مواقع'])
 async def supported_sites(ctx):
     """Show supported sites"""
-    sites = downloader.get_supported_sites()
+    await ctx.defer()
+    sites = await asyncio.to_thread(downloader.get_supported_sites)
     
     embed = discord.Embed(
         title="🌐 المواقع المدعومة",
@@ -373,7 +1778,7 @@ async def supported_sites(ctx):
     embed.set_footer(text="وأكثر من 1000+ موقع آخر!")
     await ctx.send(embed=embed)
 
-@bot.command(name='info', aliases=['معلومات'])
+@bot.hybrid_command(name='info', aliases=['معلومات'])
 async def bot_info(ctx):
     """Show bot information"""
     embed = discord.Embed(
@@ -384,13 +1789,13 @@ async def bot_info(ctx):
     
     embed.add_field(
         name="📋 أوامر التحميل",
-        value="`!download [رابط]` - تحميل فيديو\n`!sites` - المواقع المدعومة",
+        value="`!download [رابط] [رابط...]` - تحميل فيديو أو أكثر\n`!download playlist [رابط]` - تحميل قائمة تشغيل\n`!audio [رابط]` - تحميل الصوت فقط\n`!sites` - المواقع المدعومة",
         inline=False
     )
     
     embed.add_field(
         name="🎤 أوامر الصوت",
-        value="`!say [نص]` - تحويل النص إلى كلام\n`!join` - الانضمام للروم الصوتي\n`!leave` - مغادرة الروم الصوتي\n`!stop` - إيقاف التشغيل",
+        value="`!say [نص]` - تحويل النص إلى كلام\n`!play [رابط]` - تشغيل مقطع في الروم الصوتي\n`!skip` - تخطي المقطع\n`!queue` - قائمة الانتظار\n`!join` - الانضمام للروم الصوتي\n`!leave` - مغادرة الروم الصوتي\n`!stop` - إيقاف التشغيل",
         inline=False
     )
     
@@ -404,7 +1809,7 @@ async def bot_info(ctx):
     if ctx.author.guild_permissions.administrator:
         embed.add_field(
             name="👨‍💻 أوامر المطورين",
-            value="`!announce [رسالة]` - إرسال إعلان\n`!update_notify [عنوان] [وصف]` - إشعار تحديث\n`!set_update_channel` - تعيين قناة التحديثات",
+            value="`!announce [رسالة]` - إرسال إعلان\n`!update_notify [عنوان] [وصف]` - إشعار تحديث\n`!set_update_channel` - تعيين قناة التحديثات\n`!config` - إعدادات السيرفر",
             inline=False
         )
     
@@ -420,12 +1825,18 @@ async def bot_info(ctx):
         inline=False
     )
     
+    embed.add_field(
+        name="⚡ أوامر السلاش",
+        value="جميع أوامر التحميل والصوت متاحة أيضاً كأوامر `/` مثل `/download` و `/play`",
+        inline=False
+    )
+    
     embed.set_thumbnail(url=bot.user.avatar.url if bot.user.avatar else None)
     embed.set_footer(text="تم التطوير بواسطة Cascade AI")
     
     await ctx.send(embed=embed)
 
-@bot.command(name='ping')
+@bot.hybrid_command(name='ping')
 async def ping(ctx):
     """Check bot latency"""
     latency = round(bot.latency * 1000)
@@ -436,7 +1847,9 @@ async def ping(ctx):
     )
     await ctx.send(embed=embed)
 
-@bot.command(name='say', aliases=['قول', 'تكلم'])
+@bot.hybrid_command(name='say', aliases=['قول', 'تكلم'])
+@commands.guild_only()
+@app_commands.describe(text="النص المراد قوله في الروم الصوتي")
 async def text_to_speech(ctx, *, text: str = None):
     """Convert text to speech and play in voice channel"""
     if not text:
@@ -461,17 +1874,30 @@ async def text_to_speech(ctx, *, text: str = None):
         await ctx.send("❌ ليس لدي صلاحية للانضمام أو التحدث في هذا الروم!")
         return
     
+    # TTS reconnects the voice client, which would cut off the music queue
+    player = players.get(ctx.guild.id)
+    if player and player.is_busy():
+        await ctx.send("❌ يتم تشغيل قائمة الانتظار حالياً، استخدم `!stop` أولاً")
+        return
+    
+    # Generating speech and joining voice take a few seconds
+    await ctx.defer()
+    
+    # Temp audio lives in a storage workspace so every exit path removes it
+    tts_workspace = contextlib.ExitStack()
+    
     try:
         # Send loading message
         loading_msg = await ctx.send("🎤 جاري تحويل النص إلى كلام...")
         
-        # Generate TTS audio
-        tts = gtts.gTTS(text=text, lang='ar', slow=False)
+        # Generate TTS audio (import and network request stay off the event loop)
+        gtts = await asyncio.to_thread(lazy_import, 'gtts')
+        tts = gtts.gTTS(text=text, lang=settings.get(ctx.guild.id, 'tts_language', 'ar'), slow=False)
         
         # Save to temporary file
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.mp3') as tmp_file:
-            tts.save(tmp_file.name)
-            audio_file = tmp_file.name
+        work_dir = tts_workspace.enter_context(storage.workspace(TTS_RESERVE_BYTES, prefix='tts-'))
+        audio_file = os.path.join(work_dir, 'speech.mp3')
+        await asyncio.to_thread(tts.save, audio_file)
         
         # Connect to voice channel with retry logic
         voice_client = None
@@ -504,10 +1930,10 @@ async def text_to_speech(ctx, *, text: str = None):
             except discord.errors.ConnectionClosed as e:
                 retry_count += 1
                 if e.code == 4006:
-                    logger.warning(f"Voice session expired (4006) - attempt {retry_count}")
+                    logger.warning("Voice session expired (4006) - attempt %d", retry_count)
                     await asyncio.sleep(3.0)  # Longer wait for session expiry
                 else:
-                    logger.warning(f"Voice connection closed ({e.code}) - attempt {retry_count}")
+                    logger.warning("Voice connection closed (%s) - attempt %d", e.code, retry_count)
                     await asyncio.sleep(2.0)
                 
                 if voice_client:
@@ -521,7 +1947,7 @@ async def text_to_speech(ctx, *, text: str = None):
                     
             except Exception as e:
                 retry_count += 1
-                logger.warning(f"Voice connection attempt {retry_count} failed: {str(e)}")
+                logger.warning("Voice connection attempt %d failed: %s", retry_count, e)
                 
                 if voice_client:
                     try:
@@ -574,12 +2000,6 @@ async def text_to_speech(ctx, *, text: str = None):
                 await voice_client.disconnect(force=True)
         except Exception as e:
             logger.warning(f"Error disconnecting voice client: {str(e)}")
-        
-        # Clean up temporary file
-        try:
-            os.unlink(audio_file)
-        except Exception as e:
-            logger.warning(f"Error cleaning up temp file: {str(e)}")
             
     except discord.errors.ClientException as e:
         # This is often a false error when audio finishes normally
@@ -609,17 +2029,15 @@ async def text_to_speech(ctx, *, text: str = None):
         except Exception as cleanup_error:
             logger.warning(f"Error in force cleanup: {str(cleanup_error)}")
         
-        # Clean up any remaining temp files
-        try:
-            if 'audio_file' in locals():
-                os.unlink(audio_file)
-        except:
-            pass
-        
         # Wait for cleanup
         await asyncio.sleep(1.0)
+    
+    finally:
+        # Remove the temp audio whatever happened above
+        tts_workspace.close()
 
-@bot.command(name='join', aliases=['انضم'])
+@bot.hybrid_command(name='join', aliases=['انضم'])
+@commands.guild_only()
 async def join_voice(ctx):
     """Join user's voice channel"""
     if not ctx.author.voice:
@@ -634,6 +2052,8 @@ async def join_voice(ctx):
         await ctx.send("❌ ليس لدي صلاحية للانضمام أو التحدث في هذا الروم!")
         return
     
+    await ctx.defer()
+    
     try:
         if ctx.voice_client:
             if ctx.voice_client.channel == voice_channel:
@@ -659,11 +2079,15 @@ async def join_voice(ctx):
         await ctx.send(f"❌ خطأ في الانضمام للروم الصوتي: {str(e)}")
         logger.error(f"Join voice error: {str(e)}")
 
-@bot.command(name='leave', aliases=['اخرج', 'غادر'])
+@bot.hybrid_command(name='leave', aliases=['اخرج', 'غادر'])
+@commands.guild_only()
 async def leave_voice(ctx):
     """Leave voice channel"""
     if ctx.voice_client:
         try:
+            player = players.get(ctx.guild.id)
+            if player:
+                await player.destroy()
             channel_name = ctx.voice_client.channel.name
             await ctx.voice_client.disconnect(force=True)
             await ctx.send(f"👋 تم مغادرة الروم الصوتي: {channel_name}")
@@ -673,19 +2097,119 @@ async def leave_voice(ctx):
     else:
         await ctx.send("❌ لست متصل بأي روم صوتي!")
 
-@bot.command(name='stop', aliases=['توقف', 'ايقاف'])
+@bot.hybrid_command(name='stop', aliases=['توقف', 'ايقاف'])
+@commands.guild_only()
 async def stop_audio(ctx):
-    """Stop current audio playback"""
+    """Stop current audio playback and clear the queue"""
+    player = players.get(ctx.guild.id)
+    if player:
+        player.clear()
+    
     if ctx.voice_client and ctx.voice_client.is_playing():
         ctx.voice_client.stop()
         await ctx.send("⏹️ تم إيقاف التشغيل")
     else:
         await ctx.send("❌ لا يوجد صوت يتم تشغيله حالياً!")
 
-@bot.command(name='announce', aliases=['اعلان'])
+@bot.hybrid_command(name='play', aliases=['p', 'شغل'])
+@commands.guild_only()
+@app_commands.describe(url="رابط المقطع المراد تشغيله")
+async def play_audio(ctx, *, url: str = None):
+    """Stream audio from a URL into your voice channel"""
+    if not url:
+        embed = discord.Embed(
+            title="🎶 تشغيل في الروم الصوتي",
+            description="استخدم: `!play [رابط]`\n\nمثال:\n`!play https://youtube.com/watch?v=...`",
+            color=0x00ff00
+        )
+        await ctx.send(embed=embed)
+        return
+    
+    if not ctx.author.voice:
+        await ctx.send("❌ يجب أن تكون في روم صوتي أولاً!")
+        return
+    
+    voice_channel = ctx.author.voice.channel
+    
+    # Check bot permissions
+    permissions = voice_channel.permissions_for(ctx.guild.me)
+    if not permissions.connect or not permissions.speak:
+        await ctx.send("❌ ليس لدي صلاحية للانضمام أو التحدث في هذا الروم!")
+        return
+    
+    await ctx.defer()
+    loading_msg = await ctx.send("🔎 جاري تجهيز المقطع...")
+    
+    try:
+        track = await downloader.resolve_stream(url.strip('<>'))
+        if not track:
+            await loading_msg.edit(content="❌ تعذر العثور على مقطع قابل للتشغيل في هذا الرابط")
+            return
+        # The resolved track is shared through the stream cache; each queue entry gets its own copy
+        track = dict(track, requester=ctx.author.display_name)
+        
+        if ctx.voice_client and ctx.voice_client.is_connected():
+            if ctx.voice_client.channel != voice_channel:
+                await ctx.voice_client.move_to(voice_channel)
+        else:
+            await voice_channel.connect(timeout=15.0, reconnect=True)
+        
+        player = get_player(ctx)
+        was_busy = player.is_busy()
+        position = player.enqueue(track)
+        
+        if position is None:
+            await loading_msg.edit(content=f"❌ قائمة الانتظار ممتلئة (الحد الأقصى {MAX_QUEUE_SIZE})")
+        elif was_busy:
+            await loading_msg.edit(content=f"➕ تمت إضافة **{track['title']}** إلى قائمة الانتظار (#{position})")
+        else:
+            await loading_msg.delete()
+    
+    except discord.errors.ConnectionClosed as e:
+        logger.error(f"Voice connection failed in play command: {str(e)}")
+        await loading_msg.edit(content=f"❌ فشل الاتصال الصوتي (كود: {e.code})")
+    
+    except Exception as e:
+        logger.error(f"Play command error: {str(e)}")
+        await loading_msg.edit(content=f"❌ خطأ في التشغيل: {str(e)}")
+
+@bot.hybrid_command(name='skip', aliases=['تخطي'])
+@commands.guild_only()
+async def skip_track(ctx):
+    """Skip the current track"""
+    player = players.get(ctx.guild.id)
+    if player and player.skip():
+        await ctx.send("⏭️ تم التخطي")
+    else:
+        await ctx.send("❌ لا يوجد صوت يتم تشغيله حالياً!")
+
+@bot.hybrid_command(name='queue', aliases=['q', 'قائمة_الانتظار'])
+@commands.guild_only()
+async def show_queue(ctx):
+    """Show the guild's playback queue"""
+    player = players.get(ctx.guild.id)
+    if not player or not player.is_busy():
+        await ctx.send("📭 قائمة الانتظار فارغة")
+        return
+    
+    embed = discord.Embed(title="🎶 قائمة الانتظار", color=0x0099ff)
+    if player.current:
+        embed.add_field(name="▶️ الآن", value=player.current['title'], inline=False)
+    if player.tracks:
+        lines = [f"{i}. {track['title']} — {track['requester']}" for i, track in enumerate(list(player.tracks)[:10], 1)]
+        if len(player.tracks) > 10:
+            lines.append(f"... و {len(player.tracks) - 10} أخرى")
+        embed.add_field(name="⏳ التالي", value="\n".join(lines)[:1024], inline=False)
+    
+    await ctx.send(embed=embed)
+
+@bot.hybrid_command(name='announce', aliases=['اعلان'])
 @commands.has_permissions(administrator=True)
+@app_commands.default_permissions(administrator=True)
+@app_commands.describe(message="نص الإعلان")
 async def announce_update(ctx, *, message: str = None):
     """Send update announcement (Admin only)"""
+    await ctx.defer()
     if not message:
         embed = discord.Embed(
             title="📢 إرسال إعلان تحديث",
@@ -695,7 +2219,10 @@ async def announce_update(ctx, *, message: str = None):
         await ctx.send(embed=embed)
         return
     
-    await send_update_notification(
+    # Bot owners broadcast to every configured guild; server admins only reach their own
+    target_guild = None if await bot.is_owner(ctx.author) else ctx.guild
+    delivered = await send_update_notification(
+        guild=target_guild,
         title="إعلان جديد",
         description=message,
         color=0x0099ff,
@@ -713,12 +2240,18 @@ async def announce_update(ctx, *, message: str = None):
         ]
     )
     
-    await ctx.send("✅ تم إرسال الإعلان لقناة التحديثات!")
+    if delivered:
+        await ctx.send("✅ تم إرسال الإعلان لقناة التحديثات!")
+    else:
+        await ctx.send("❌ لم يتم تعيين قناة للتحديثات! استخدم `!set_update_channel`")
 
-@bot.command(name='update_notify', aliases=['اشعار_تحديث'])
+@bot.hybrid_command(name='update_notify', aliases=['اشعار_تحديث'])
 @commands.has_permissions(administrator=True)
+@app_commands.default_permissions(administrator=True)
+@app_commands.describe(title="عنوان التحديث", description="وصف التحديث")
 async def update_notify(ctx, title: str = None, *, description: str = None):
     """Send formatted update notification (Admin only)"""
+    await ctx.defer()
     if not title or not description:
         embed = discord.Embed(
             title="🔄 إرسال إشعار تحديث",
@@ -728,7 +2261,10 @@ async def update_notify(ctx, title: str = None, *, description: str = None):
         await ctx.send(embed=embed)
         return
     
-    await send_update_notification(
+    # Bot owners broadcast to every configured guild; server admins only reach their own
+    target_guild = None if await bot.is_owner(ctx.author) else ctx.guild
+    delivered = await send_update_notification(
+        guild=target_guild,
         title=title,
         description=description,
         color=0x00ff00,
@@ -751,19 +2287,25 @@ async def update_notify(ctx, title: str = None, *, description: str = None):
         ]
     )
     
-    await ctx.send("✅ تم إرسال إشعار التحديث!")
+    if delivered:
+        await ctx.send("✅ تم إرسال إشعار التحديث!")
+    else:
+        await ctx.send("❌ لم يتم تعيين قناة للتحديثات! استخدم `!set_update_channel`")
 
-@bot.command(name='set_update_channel', aliases=['تعيين_قناة_التحديثات'])
+@bot.hybrid_command(name='set_update_channel', aliases=['تعيين_قناة_التحديثات'])
 @commands.has_permissions(administrator=True)
+@app_commands.default_permissions(administrator=True)
+@app_commands.describe(channel="القناة (الافتراضي: القناة الحالية)")
 async def set_update_channel(ctx, channel: discord.TextChannel = None):
     """Set the update notifications channel (Admin only)"""
     if not channel:
         channel = ctx.channel
     
-    # This would normally save to database, but for now we'll just confirm
+    await settings.set(ctx.guild.id, 'update_channel_id', channel.id)
+    
     embed = discord.Embed(
         title="📢 تعيين قناة التحديثات",
-        description=f"تم تعيين {channel.mention} كقناة للتحديثات!\n\n**ملاحظة:** لجعل هذا دائماً، أضف `UPDATE_CHANNEL_ID={channel.id}` في ملف .env",
+        description=f"تم تعيين {channel.mention} كقناة للتحديثات!",
         color=0x00ff00
     )
     
@@ -771,12 +2313,87 @@ async def set_update_channel(ctx, channel: discord.TextChannel = None):
     
     # Send test notification
     await send_update_notification(
+        guild=ctx.guild,
         title="تم تعيين قناة التحديثات",
         description=f"هذه القناة ستستقبل جميع إشعارات التحديثات والإعلانات",
         color=0x0099ff
     )
 
-@bot.command(name='version', aliases=['اصدار'])
+SETTING_LABELS = {
+    'update_channel_id': "📢 قناة التحديثات",
+    'upload_limit_mb': "📁 حد الرفع (ميجابايت)",
+    'max_concurrent_jobs': "⚙️ عدد التحميلات المتزامنة",
+    'tts_language': "🎤 لغة تحويل النص إلى كلام",
+    'voice_idle_timeout': "⏱️ مهلة الخمول الصوتي (ثانية)",
+}
+
+@bot.hybrid_command(name='config', aliases=['settings', 'اعدادات'])
+@commands.guild_only()
+# Hidden from members in the slash picker; the prefix form still lets anyone view the settings
+@app_commands.default_permissions(administrator=True)
+@app_commands.describe(key="اسم الإعداد", value="القيمة الجديدة أو reset")
+async def guild_config(ctx, key: str = None, *, value: str = None):
+    """Show or change this server's settings (changing is Admin only)"""
+    if key is None:
+        current = settings.for_guild(ctx.guild.id)
+        embed = discord.Embed(
+            title="⚙️ إعدادات السيرفر",
+            description="للتعديل: `!config [الإعداد] [القيمة]`\nللعودة للافتراضي: `!config [الإعداد] reset`",
+            color=0x0099ff
+        )
+        for name, label in SETTING_LABELS.items():
+            shown = current.get(name, "افتراضي")
+            if name == 'update_channel_id' and name in current:
+                shown = f"<#{shown}>"
+            embed.add_field(name=label, value=f"`{name}`: {shown}", inline=False)
+        await ctx.send(embed=embed)
+        return
+    
+    if not ctx.author.guild_permissions.administrator:
+        raise commands.MissingPermissions(['administrator'])
+    
+    key = key.lower()
+    if key not in SETTING_LABELS or value is None:
+        await ctx.send(f"❌ إعداد غير معروف أو قيمة مفقودة! الإعدادات المتاحة: {', '.join(f'`{name}`' for name in SETTING_LABELS)}")
+        return
+    
+    try:
+        if value.lower() in ('reset', 'default', 'افتراضي'):
+            await settings.set(ctx.guild.id, key, None)
+            await ctx.send(f"✅ تمت إعادة {SETTING_LABELS[key]} إلى القيمة الافتراضية")
+            return
+        
+        if key == 'update_channel_id':
+            # Only channels of this server; otherwise !announce could post into another guild
+            channel_id = value.strip('<#>')
+            channel = ctx.guild.get_channel(int(channel_id)) if channel_id.isdigit() else None
+            if not isinstance(channel, discord.TextChannel):
+                await ctx.send("❌ القناة غير موجودة في هذا السيرفر أو ليست قناة نصية")
+                return
+            value = str(channel.id)
+        elif key == 'tts_language':
+            gtts_lang = await asyncio.to_thread(lazy_import, 'gtts.lang')
+            if value.lower() not in gtts_lang.tts_langs():
+                await ctx.send("❌ لغة غير مدعومة! مثال: `ar`, `en`, `fr`")
+                return
+            value = value.lower()
+        await settings.set(ctx.guild.id, key, value)
+        await ctx.send(f"✅ تم تعيين {SETTING_LABELS[key]}: `{settings.get(ctx.guild.id, key)}`")
+    
+    except ValueError:
+        await ctx.send(f"❌ قيمة غير صالحة لـ {SETTING_LABELS[key]}")
+
+@bot.hybrid_command(name='sync')
+@commands.is_owner()
+@app_commands.default_permissions(administrator=True)
+async def sync_commands(ctx):
+    """Publish slash commands to Discord (Owner only)"""
+    # A global sync can take longer than the 3-second interaction deadline
+    await ctx.defer()
+    synced = await bot.tree.sync()
+    await ctx.send(f"✅ تمت مزامنة {len(synced)} أمر سلاش")
+
+@bot.hybrid_command(name='version', aliases=['اصدار'])
 async def show_version(ctx):
     """Show current bot version and update info"""
     embed = discord.Embed(
@@ -814,18 +2431,152 @@ async def show_version(ctx):
     
     await ctx.send(embed=embed)
 
+def snapshot_player_jobs():
+    """Describe every queued or playing track so the next instance can continue the queue"""
+    pending = []
+    for player in players.values():
+        voice_client = player.guild.voice_client
+        if not voice_client or not voice_client.channel:
+            continue
+        for track in ([player.current] if player.current else []) + list(player.tracks):
+            pending.append({
+                'kind': 'play',
+                'url': track['webpage_url'],
+                'channel_id': player.text_channel.id,
+                'voice_channel_id': voice_client.channel.id,
+                'requester': track.get('requester', ''),
+            })
+    return pending
+
+async def notify_cut_off(cut_off):
+    """Tell the affected channels which running jobs were interrupted by the restart"""
+    by_channel = {}
+    for job in cut_off:
+        by_channel.setdefault(job['channel_id'], []).append(job['url'])
+    
+    for channel_id, urls in by_channel.items():
+        channel = bot.get_channel(channel_id)
+        if not channel:
+            continue
+        lines = "\n".join(f"• <{url}>" for url in urls[:10])
+        try:
+            await channel.send(f"⚠️ انقطعت هذه التحميلات بسبب إعادة تشغيل البوت وستُستكمل تلقائياً:\n{lines}")
+        except discord.HTTPException:
+            pass
+
+class ResumedContext:
+    """Minimal stand-in for commands.Context when re-running a persisted job"""
+
+    def __init__(self, channel, requester):
+        self.channel = channel
+        self.guild = getattr(channel, 'guild', None)
+        self.author = types.SimpleNamespace(display_name=requester)
+
+    async def defer(self):
+        pass
+
+    async def send(self, *args, **kwargs):
+        return await self.channel.send(*args, **kwargs)
+
+async def resume_pending_jobs():
+    """Run the jobs the previous instance handed over during its drain"""
+    pending = await lifecycle.take_pending_jobs()
+    if not pending:
+        return
+    logger.info("Resuming %d jobs from the previous instance", len(pending))
+    
+    downloads = {}
+    plays = {}
+    for job in pending:
+        if job.get('kind') == 'play':
+            plays.setdefault(job['voice_channel_id'], []).append(job)
+        else:
+            clip = tuple(job['clip']) if job.get('clip') else None
+            downloads.setdefault((job['channel_id'], job['kind'], job.get('requester', ''), clip), []).append(job['url'])
+    
+    tasks = []
+    for (channel_id, kind, requester, clip), urls in downloads.items():
+        channel = bot.get_channel(channel_id)
+        if channel:
+            tasks.append(resume_download_batch(
+                ResumedContext(channel, requester), urls, audio=kind == 'audio', clip=clip
+            ))
+    for voice_channel_id, tracks in plays.items():
+        tasks.append(resume_player(voice_channel_id, tracks))
+    
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+async def resume_download_batch(ctx, urls, audio=False, clip=None):
+    jobs.begin_operation()
+    try:
+        await ctx.send("🔄 استكمال التحميلات التي انقطعت بسبب إعادة التشغيل...")
+        # Several postponed batches can share a channel; keep each run within the batch cap
+        for i in range(0, len(urls), MAX_BATCH_ITEMS):
+            await run_download_batch(ctx, urls[i:i + MAX_BATCH_ITEMS], audio=audio, clip=clip)
+    finally:
+        jobs.end_operation()
+
+async def resume_player(voice_channel_id, tracks):
+    voice_channel = bot.get_channel(voice_channel_id)
+    text_channel = bot.get_channel(tracks[0]['channel_id'])
+    # Nobody left to listen, so don't rejoin
+    if not voice_channel or not text_channel or not [m for m in voice_channel.members if not m.bot]:
+        return
+    
+    try:
+        if not voice_channel.guild.voice_client:
+            await voice_channel.connect(timeout=15.0, reconnect=True)
+        player = players.get(voice_channel.guild.id)
+        if player is None:
+            player = players[voice_channel.guild.id] = GuildPlayer(voice_channel.guild, text_channel)
+        for job in tracks:
+            track = await downloader.resolve_stream(job['url'])
+            if track:
+                player.enqueue(dict(track, requester=job.get('requester', '')))
+    except Exception as e:
+        logger.error(f"Could not resume playback in guild {voice_channel.guild.id}: {str(e)}")
+
 async def shutdown_handler():
-    """Handle graceful shutdown"""
+    """Handle graceful shutdown: drain running work, hand the rest to the next instance"""
+    if lifecycle.shutting_down:
+        return
     logger.info("Shutdown signal received - starting graceful shutdown")
+    lifecycle.shutting_down = True
+    
+    # The drain can outlast the platform's stop grace period (Docker defaults to 10 s), so save
+    # every queued and running job right away; the list is rewritten once the drain is over.
+    # If SIGKILL lands in between, jobs that did finish are simply run once more.
+    lifecycle.save_pending_jobs(jobs.registered_jobs() + snapshot_player_jobs())
+    
+    await jobs.drain(DRAIN_TIMEOUT)
+    pending = jobs.postponed + snapshot_player_jobs()
+    lifecycle.save_pending_jobs(pending)
+    logger.info(
+        "Drain finished: %d jobs handed to the next instance, %d were cut off while running",
+        len(pending), len(jobs.cut_off)
+    )
+    if jobs.cut_off:
+        await notify_cut_off(jobs.cut_off)
+    
+    storage.stop_janitor()
+    await media_workers.close()
+    settings.close()
     await cleanup_connections()
     await bot.close()
     logger.info("Bot shutdown completed")
 
-def signal_handler(signum, frame):
+def signal_handler(signum):
     """Handle shutdown signals"""
     logger.info(f"Received signal {signum}")
-    loop = asyncio.get_event_loop()
-    loop.create_task(shutdown_handler())
+    asyncio.create_task(shutdown_handler())
+
+def install_signal_handlers():
+    """Route SIGTERM/SIGINT into the running loop so shutdown can drain first"""
+    if sys.platform == 'win32':
+        return
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, signal_handler, signum)
 
 if __name__ == "__main__":
     # Get bot token from environment variable
@@ -835,13 +2586,11 @@ if __name__ == "__main__":
         print("يرجى إضافة التوكن في ملف .env أو متغيرات البيئة")
         exit(1)
     
-    # Setup signal handlers for graceful shutdown
-    if sys.platform != 'win32':
-        signal.signal(signal.SIGTERM, signal_handler)
-        signal.signal(signal.SIGINT, signal_handler)
+    startup_timer.mark('module init')
     
     try:
-        bot.run(token)
+        # log_handler=None keeps discord.py from adding its own synchronous handler
+        bot.run(token, log_handler=None)
     except discord.LoginFailure:
         print("❌ خطأ في تسجيل الدخول: تأكد من صحة التوكن")
         logger.error("Discord login failure - invalid token")
@@ -0,0 +1,241 @@
+#!/usr/bin/env python3
+"""
+Media worker for Discord Video Downloader Bot
+
+A long-lived worker process that runs yt-dlp jobs (downloads, playlist listings and
+stream lookups) under memory and CPU-time limits, so a pathological video cannot
+balloon the bot's memory or pin its CPU. It keeps yt-dlp imported and one YoutubeDL
+instance per profile warm between jobs. The same job functions are used in-process
+by bot.py when sandboxing is disabled.
+
+Usage: media_worker.py <max_memory_bytes> <max_cpu_seconds_per_job>
+
+Protocol: one JSON job per line on stdin, one JSON response per line on the original
+stdout; everything yt-dlp and ffmpeg print goes to stderr.
+"""
+
+import json
+import os
+import sys
+import time
+
+MEDIA_EXTENSIONS = ('.mp4', '.mkv', '.webm', '.avi', '.m4a', '.opus', '.ogg', '.mp3', '.aac')
+
+class SizeLimitLogger:
+    """yt-dlp logger that passes output through to stderr and notices max-filesize skips"""
+
+    def __init__(self):
+        self.oversize = False
+
+    def debug(self, msg):
+        # yt-dlp reports both "larger than max-filesize, skipping" and the mid-download abort here
+        if 'max-filesize' in msg:
+            self.oversize = True
+        print(msg, file=sys.stderr)
+
+    info = warning = error = debug
+
+def live_clip(info, clip):
+    """Clamp a clip of an ongoing broadcast to what has aired; returns (clip, error)"""
+    # FFmpegFD applies section cuts to HLS, but not to the live-from-start DASH formats
+    selected = info.get('requested_formats') or [info]
+    if not all(str(fmt.get('protocol', '')).startswith('m3u8') for fmt in selected):
+        return None, "قص هذا البث المباشر غير مدعوم أثناء البث، جرب بعد انتهائه"
+
+    start, end = clip
+    started_at = info.get('release_timestamp') or info.get('timestamp')
+    if started_at:
+        end = min(end, int(time.time() - started_at))
+        if start >= end:
+            return None, "وقت البداية لم يُبث بعد"
+    return (start, end), None
+
+def too_big(max_file_size):
+    """The user-facing error for a file over the upload cap"""
+    return None, f"حجم الملف كبير جداً (أكثر من {max_file_size // (1024 * 1024)} ميجابايت)"
+
+def download(ydl, url, output_path, max_file_size, max_duration=600, clip=None):
+    """Download url (or only its clip=(start, end) section) into output_path; returns (file_path, error)"""
+    # Extract info first
+    info = ydl.extract_info(url, download=False)
+    if not info:
+        return None, "تعذر استخراج معلومات الفيديو"
+    title = info.get('title', 'Unknown')
+    duration = info.get('duration', 0)
+
+    # A whole ongoing broadcast never finishes downloading; only clips of it are allowed
+    if info.get('is_live'):
+        if not clip:
+            return None, "لا يمكن تحميل بث مباشر كامل، حدد وقت البداية والنهاية"
+        clip, error = live_clip(info, clip)
+        if error:
+            return None, error
+
+    # Check duration limits; for a clip only the section counts
+    if clip:
+        start, end = clip
+        if duration and start >= duration:
+            return None, "وقت البداية بعد نهاية الفيديو"
+        if end - start > max_duration:
+            return None, f"المقطع طويل جداً (أكثر من {max_duration // 60} دقائق)"
+    elif duration and duration > max_duration:
+        return None, f"فيديو طويل جداً (أكثر من {max_duration // 60} دقائق)"
+
+    if clip:
+        from yt_dlp.utils import download_range_func
+
+        # Fetch only the section; cuts snap to keyframes so it stays a stream copy
+        ydl.params['download_ranges'] = download_range_func(None, [tuple(clip)])
+        ydl.params['force_keyframes_at_cuts'] = False
+
+    # Download the already extracted info instead of extracting twice
+    size_logger = ydl.params['logger'] = SizeLimitLogger()
+    try:
+        ydl.process_ie_result(info, download=True)
+    finally:
+        # Pooled instances are reused by other jobs
+        ydl.params.pop('download_ranges', None)
+        ydl.params.pop('logger', None)
+
+    # Find the downloaded file
+    for file in os.listdir(output_path or '.'):
+        if file.endswith(('.part', '.ytdl')):
+            continue
+        if title.replace('/', '_').replace('\\', '_') in file or any(file.endswith(ext) for ext in MEDIA_EXTENSIONS):
+            file_path = os.path.join(output_path or '.', file)
+            file_size = os.path.getsize(file_path)
+
+            # Discord file size limit (8MB for free, 50MB for Nitro)
+            if file_size > max_file_size:
+                os.remove(file_path)
+                return too_big(max_file_size)
+
+            return file_path, None
+
+    if size_logger.oversize:
+        return too_big(max_file_size)
+    return None, "لم يتم العثور على الملف المحمل"
+
+def list_entries(ydl, url, limit):
+    """Entry URLs of a playlist from a flat extraction (or [url] for a single video)"""
+    info = ydl.extract_info(url, download=False)
+    if not info:
+        return []
+
+    entries = info.get('entries')
+    if entries is None:
+        return [info.get('webpage_url') or url]
+
+    urls = []
+    for entry in entries:
+        entry_url = entry and (entry.get('url') or entry.get('webpage_url'))
+        if entry_url:
+            urls.append(entry_url)
+        if len(urls) >= limit:
+            break
+    return urls
+
+def resolve_stream(ydl, url):
+    """Direct audio stream URL and metadata for url, or None"""
+    info = ydl.extract_info(url, download=False)
+
+    if info and info.get('entries'):
+        info = next((entry for entry in info['entries'] if entry), None)
+    if not info or not info.get('url'):
+        return None
+
+    return {
+        'title': info.get('title', 'Unknown'),
+        'webpage_url': info.get('webpage_url') or url,
+        'stream_url': info['url'],
+        'acodec': info.get('acodec'),
+        'duration': info.get('duration'),
+    }
+
+def apply_memory_limit(max_memory_bytes):
+    """Cap the address space of this process (and the ffmpeg children it spawns)"""
+    import resource
+
+    if max_memory_bytes:
+        resource.setrlimit(resource.RLIMIT_AS, (max_memory_bytes, max_memory_bytes))
+
+def cpu_seconds():
+    """CPU time used so far by this process and its finished children"""
+    import resource
+
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+def limit_next_job_cpu(max_cpu_seconds):
+    """Allow the next job max_cpu_seconds on top of what this long-lived process already used"""
+    import resource
+
+    if not max_cpu_seconds:
+        return
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    # SIGXCPU at the soft limit kills the worker; ffmpeg children inherit the same allowance
+    soft = int(own.ru_utime + own.ru_stime) + max_cpu_seconds
+    if hard != resource.RLIM_INFINITY:
+        soft = min(soft, hard)
+    resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+
+def run_job(job, instances):
+    """Dispatch one job to the matching function on a warm YoutubeDL instance"""
+    import yt_dlp
+
+    action = job['action']
+    profile = job.get('profile', action)
+    ydl = instances.get(profile)
+    if ydl is None:
+        ydl = instances[profile] = yt_dlp.YoutubeDL(job['opts'])
+    # Per-job overrides on top of the profile's options, as in bot.YoutubeDLPool
+    ydl.params.update(job.get('params', {}))
+
+    if action == 'warm':
+        return None
+    if action == 'download':
+        return download(
+            ydl, job['url'], job['output_path'], job['max_file_size'],
+            job.get('max_duration', 600), job.get('clip')
+        )
+    if action == 'entries':
+        return list_entries(ydl, job['url'], job['limit'])
+    if action == 'stream':
+        return resolve_stream(ydl, job['url'])
+    raise ValueError(f"Unknown action: {action}")
+
+def main():
+    """Serve jobs, one JSON object per line on stdin, until stdin is closed"""
+    # Keep the real stdout for the responses and send all other output to stderr
+    result_out = os.fdopen(os.dup(1), 'w', encoding='utf-8')
+    os.dup2(2, 1)
+
+    max_memory_bytes, max_cpu_seconds = (int(arg) for arg in sys.argv[1:3])
+    apply_memory_limit(max_memory_bytes)
+    instances = {}  # profile -> YoutubeDL, kept warm between jobs
+
+    while True:
+        line = sys.stdin.readline()
+        if not line:
+            break
+        job = json.loads(line)
+        limit_next_job_cpu(max_cpu_seconds)
+        started_cpu = cpu_seconds()
+
+        response = {}
+        try:
+            response['result'] = run_job(job, instances)
+        except MemoryError:
+            response['error'] = 'memory limit exceeded'
+            response['limit'] = 'memory'
+        except Exception as e:
+            response['error'] = str(e)
+
+        response['usage'] = {'cpu_seconds': round(cpu_seconds() - started_cpu, 2)}
+        result_out.write(json.dumps(response, ensure_ascii=False) + '\n')
+        result_out.flush()
+
+if __name__ == '__main__':
+    main()